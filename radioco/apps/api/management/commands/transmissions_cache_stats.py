@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from radioco.apps.api import transmissions_cache
+
+
+class Command(BaseCommand):
+    help = 'Show the hits and misses of the transmissions cache of the API.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', default=False, help='Reset the counters')
+
+    def handle(self, *args, **options):
+        stats = transmissions_cache.get_stats()
+        total = stats['hits'] + stats['misses']
+        ratio = 100.0 * stats['hits'] / total if total else 0
+        self.stdout.write('Hits: {hits}, misses: {misses} ({ratio:.1f}% hit ratio)'.format(ratio=ratio, **stats))
+        if options['reset']:
+            transmissions_cache.reset_stats()
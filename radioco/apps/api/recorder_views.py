@@ -1,4 +1,5 @@
 import datetime
+import hashlib
 import json
 
 from django.conf import settings
@@ -7,24 +8,43 @@ from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
 from django.utils.translation import ugettext as _
+from django.views.decorators.http import condition
 from rest_framework.authentication import BasicAuthentication, TokenAuthentication
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from rest_framework.permissions import IsAuthenticated
 
+from radioco.apps.api.views import schedules_etag
 from radioco.apps.global_settings.models import PodcastConfiguration
 from radioco.apps.programmes.models import Episode, Programme, Podcast
+from radioco.apps.radioco import local_cache
+from radioco.apps.radioco.utils import is_cache_shared
 from radioco.apps.radioco.tz_utils import transform_dt_to_default_tz
-from radioco.apps.schedules.models import Schedule, Transmission
+from radioco.apps.schedules.models import Calendar, Schedule, Transmission
 
 
 def check_recorder_program(user):
     return user.username == settings.USERNAME_RADIOCO_RECORDER
 
 
+def recording_schedules_etag(request, *args, **kwargs):
+    """
+    ETag of the recording schedules, it also changes when the podcast configuration does
+    Without a shared cache episodes created by other processes (e.g. create_episodes) can't be detected
+    """
+    if not is_cache_shared():
+        return None
+    etag = schedules_etag(request)
+    version = local_cache.get_version()
+    if etag is None or version is None:
+        return None
+    return hashlib.md5('{etag}|{version}'.format(etag=etag, version=version)).hexdigest()
+
+
 @api_view(['GET'])
 @authentication_classes((BasicAuthentication, TokenAuthentication))
 @permission_classes((IsAuthenticated,))
 @user_passes_test(check_recorder_program)
+@condition(etag_func=recording_schedules_etag)
 def recording_schedules(request):
     podcast_config = PodcastConfiguration.get_global()
     default_tz = timezone.get_default_timezone()
@@ -32,16 +52,15 @@ def recording_schedules(request):
     next_hours = int(request.GET.get("next_hours") or podcast_config.next_events)
 
     json_list = []
-    next_transmissions = Transmission.between(
+    next_transmissions = list(Transmission.between(
         start, start + datetime.timedelta(hours=next_hours),
-        schedules=Schedule.objects.filter(calendar__is_active=True, type='L')
-    )
+        schedules=Schedule.objects.filter(calendar_id=Calendar.get_active_id(), type='L')
+    ))
+    # Episodes are usually created in advance by the create_episodes command, this is only a fallback
+    Transmission.create_missing_episodes(next_transmissions)
 
     for transmission in next_transmissions:
-        try:
-            episode = Episode.objects.get(issue_date=transmission.start, programme=transmission.programme)
-        except Episode.DoesNotExist:
-            episode = Episode.objects.create_episode(transmission.start, transmission.programme)
+        episode = transmission.episode
 
         issue_date = transform_dt_to_default_tz(transmission.start)
         start_dt = issue_date + datetime.timedelta(seconds=podcast_config.start_delay)
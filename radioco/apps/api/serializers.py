@@ -1,4 +1,7 @@
+from collections import OrderedDict
+
 from django.core.urlresolvers import reverse
+from django.utils import six
 
 from radioco.apps.global_settings.models import SiteConfiguration, RadiocomConfiguration
 from radioco.apps.radioco.tz_utils import transform_datetime_tz, get_active_timezone
@@ -30,6 +33,73 @@ class AbsoluteURLField(serializers.URLField):
         return super(AbsoluteURLField, self).to_representation(self.context['request'].build_absolute_uri(value)) if value else None
 
 
+DATETIME_FIELD = serializers.DateTimeField()
+
+
+def _text(value):
+    return None if value is None else six.text_type(value)
+
+
+def _integer(value):
+    return None if value is None else int(value)
+
+
+def _datetime(value, tz):
+    return DATETIME_FIELD.to_representation(transform_datetime_tz(value, tz=tz)) if value else None
+
+
+def _episode_url_format(slug):
+    """
+    Returns the episode url of a programme with placeholders for the season and the number
+    """
+    url = reverse('programmes:episode_detail', args=(slug, 0, 0))
+    if not url.endswith('/0x0/'):
+        return None
+    return url[:-len('0x0/')].replace('%', '%%') + '%dx%d/'
+
+
+class TransmissionListSerializer(serializers.ListSerializer):
+    """
+    Serializes lists of transmissions without the per item field machinery, the output is the same
+    Values shared by all the transmissions of a programme are calculated only once
+    """
+
+    def to_representation(self, data):
+        return list(self.iter_representation(data))
+
+    def iter_representation(self, data, tz=None):
+        """
+        Generator version of to_representation
+        The timezone has to be given if the generator is consumed outside of the active timezone
+        """
+        return self.localize(self.iter_neutral_representation(data), tz)
+
+    def iter_neutral_representation(self, data):
+        """
+        Representation of the transmissions with the dates as datetimes, so it doesn't depend on the timezone
+        """
+        programmes = {}
+        for transmission in data:
+            programme_data = programmes.get(transmission.programme.id)
+            if programme_data is None:
+                programme_data = self.child.get_programme_data(transmission.programme)
+                programmes[transmission.programme.id] = programme_data
+            yield self.child.get_transmission_data(transmission, programme_data)
+
+    @staticmethod
+    def localize(items, tz=None):
+        """
+        Converts the dates of neutral representations to the given timezone
+        """
+        if tz is None:
+            tz = get_active_timezone()
+        for item in items:
+            item = OrderedDict(item)
+            item['start'] = _datetime(item['start'], tz)
+            item['end'] = _datetime(item['end'], tz)
+            yield item
+
+
 class DateTimeFieldTz(serializers.DateTimeField):
     """
     Field to display the datetime in the current timezone
@@ -104,7 +174,46 @@ class TransmissionSerializer(serializers.Serializer):
     programme_url = AbsoluteURLField()
     episode_url = AbsoluteURLField()
     type = serializers.CharField(max_length=1, source='schedule.type')
-    source = serializers.IntegerField(source='schedule.source.id')
+    source = serializers.IntegerField(source='schedule.source_id')
+
+    class Meta:
+        list_serializer_class = TransmissionListSerializer
+
+    def get_programme_data(self, programme):
+        absolute_uri = self.context['request'].build_absolute_uri
+        return {
+            'name': _text(programme.name),
+            'slug': _text(programme.slug),
+            'programme': _integer(programme.id),
+            'programme_url': _text(absolute_uri(reverse('programmes:detail', args=[programme.slug]))),
+            'episode_url_format': _episode_url_format(programme.slug),
+        }
+
+    def get_transmission_data(self, transmission, programme_data):
+        absolute_uri = self.context['request'].build_absolute_uri
+        schedule = transmission.schedule
+        episode = transmission.episode
+        if not episode:
+            episode_url = None
+        elif programme_data['episode_url_format']:
+            episode_url = _text(absolute_uri(
+                programme_data['episode_url_format'] % (episode.season, episode.number_in_season)))
+        else:
+            episode_url = _text(absolute_uri(transmission.episode_url))
+        return OrderedDict((
+            ('id', _integer(schedule.id)),
+            ('name', programme_data['name']),
+            ('slug', programme_data['slug']),
+            ('start', transmission.start),
+            ('end', transmission.end),
+            ('schedule', _integer(schedule.id)),
+            ('episode', _integer(episode.id) if episode else None),
+            ('programme', programme_data['programme']),
+            ('programme_url', programme_data['programme_url']),
+            ('episode_url', episode_url),
+            ('type', _text(schedule.type)),
+            ('source', _integer(schedule.source_id)),
+        ))
 
 
 class RadiocomTransmissionSerializer(serializers.Serializer):
@@ -117,6 +226,32 @@ class RadiocomTransmissionSerializer(serializers.Serializer):
     type = serializers.CharField(max_length=1, source='schedule.type')
     rss_url = AbsoluteURLField(source='slug', reverse_url='programmes:rss')
 
+    class Meta:
+        list_serializer_class = TransmissionListSerializer
+
+    def get_programme_data(self, programme):
+        absolute_uri = self.context['request'].build_absolute_uri
+        logo_url = programme.photo.url
+        return {
+            'name': _text(programme.name),
+            'description': _text(programme.synopsis),
+            'programme_url': _text(absolute_uri(reverse('programmes:detail', args=[programme.slug]))),
+            'logo_url': _text(absolute_uri(logo_url)) if logo_url else None,
+            'rss_url': _text(absolute_uri(reverse('programmes:rss', args=[programme.slug]))),
+        }
+
+    def get_transmission_data(self, transmission, programme_data):
+        return OrderedDict((
+            ('name', programme_data['name']),
+            ('description', programme_data['description']),
+            ('start', transmission.start),
+            ('end', transmission.end),
+            ('programme_url', programme_data['programme_url']),
+            ('logo_url', programme_data['logo_url']),
+            ('type', _text(transmission.schedule.type)),
+            ('rss_url', programme_data['rss_url']),
+        ))
+
 
 class TransmissionSerializerLight(serializers.Serializer):  # WARNING: Hack to save changes
     id = serializers.IntegerField(source='schedule.id')
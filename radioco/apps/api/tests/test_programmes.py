@@ -1,5 +1,6 @@
 import datetime
 
+import mock
 from rest_framework import status
 from rest_framework.test import APITestCase
 
@@ -83,6 +84,26 @@ class TestProgrammesAPI(TestDataMixin, APITestCase):
             })
         self.assertNotIn(u'summer-programme', map(lambda t: t['slug'], response.data))
 
+    @mock.patch('radioco.apps.api.views.is_cache_shared', lambda: True)
+    def test_programmes_etag(self):
+        response = self.client.get('/api/2/programmes', {'ordering': 'name'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        response = self.client.get('/api/2/programmes', {'ordering': 'name'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        response = self.client.get('/api/2/programmes', {'ordering': '-name'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get('/api/2/programmes/summer-programme')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+        self.summer_programme.name = 'Winter Programme'
+        self.summer_programme.save()
+        response = self.client.get('/api/2/programmes', {'ordering': 'name'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
     def test_episodes_get_all(self):
         response = self.client.get('/api/2/episodes')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
@@ -1,16 +1,18 @@
 import datetime
 import json
+from StringIO import StringIO
 
 import mock
 import pytz
 import recurrence
 from django.contrib.auth.models import User
+from django.core.management import call_command
 from django.test import override_settings
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from radioco.apps.global_settings.models import PodcastConfiguration
-from radioco.apps.programmes.models import Programme, Episode
+from radioco.apps.programmes.models import Programme, Episode, Participant, Role
 from radioco.apps.schedules.models import Schedule, Calendar
 
 
@@ -104,6 +106,66 @@ class TestProgrammesAPI(APITestCase):
             ]
         )
 
+    @mock.patch('radioco.apps.global_settings.models.PodcastConfiguration.get_global', PodcastMock._get_podcast_config_mock)
+    def test_recording_schedules_creates_episodes(self):
+        self._login()
+        Role.objects.create(person=User.objects.get(username='iago'), programme=self.recorder_programme, role='Host')
+        response = self.client.get(
+            u'/api/1/recording_schedules/',
+            {
+                u'start': u'2015-01-01 00:00:00',
+                u'next_hours': 24 * 4
+            },
+            HTTP_AUTHORIZATION='Token {token}'.format(token=PodcastConfiguration.get_global().recorder_token)
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual(
+            [(_entry['album'], _entry['track']) for _entry in json.loads(response.content)],
+            [(u'Season 2', 1), (u'Season 3', 1), (u'Season 3', 2), (u'Season 3', 3)]
+        )
+        episodes = Episode.objects.filter(programme=self.recorder_programme, season=3).order_by('issue_date')
+        self.assertListEqual(
+            [(_episode.number_in_season, _episode.issue_date) for _episode in episodes],
+            [
+                (1, pytz.utc.localize(datetime.datetime(2015, 1, 2, 14, 0, 0))),
+                (2, pytz.utc.localize(datetime.datetime(2015, 1, 3, 14, 0, 0))),
+                (3, pytz.utc.localize(datetime.datetime(2015, 1, 4, 14, 0, 0))),
+            ]
+        )
+        self.assertEqual(Participant.objects.filter(episode__in=episodes, role='Host').count(), 3)
+
+    @mock.patch('radioco.apps.global_settings.models.PodcastConfiguration.get_global', PodcastMock._get_podcast_config_mock)
+    @mock.patch('radioco.apps.api.views.is_cache_shared', lambda: True)
+    @mock.patch('radioco.apps.api.recorder_views.is_cache_shared', lambda: True)
+    def test_recording_schedules_after_creating_episodes(self):
+        self._login()
+        with mock.patch('django.utils.timezone.now', lambda: pytz.utc.localize(datetime.datetime(2015, 1, 1))):
+            call_command('create_episodes', days=3, stdout=StringIO())
+        self.assertEquals(Episode.objects.filter(programme=self.recorder_programme).count(), 3)
+
+        query = {u'start': u'2015-01-01 00:00:00', u'next_hours': 24 * 3}
+        auth = 'Token {token}'.format(token=PodcastConfiguration.get_global().recorder_token)
+        with mock.patch.object(Episode.objects, 'create_episodes') as create_episodes:
+            response = self.client.get(u'/api/1/recording_schedules/', query, HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(create_episodes.called)
+        self.assertEqual(len(json.loads(response.content)), 3)
+
+        response = self.client.get(
+            u'/api/1/recording_schedules/', query, HTTP_AUTHORIZATION=auth, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @mock.patch('radioco.apps.global_settings.models.PodcastConfiguration.get_global', PodcastMock._get_podcast_config_mock)
+    @mock.patch('radioco.apps.api.views.is_cache_shared', lambda: True)
+    @mock.patch('radioco.apps.api.recorder_views.is_cache_shared', lambda: False)
+    def test_recording_schedules_cache_not_shared(self):
+        self._login()
+        query = {u'start': u'2015-01-01 00:00:00', u'next_hours': 24 * 3}
+        auth = 'Token {token}'.format(token=PodcastConfiguration.get_global().recorder_token)
+        response = self.client.get(u'/api/1/recording_schedules/', query, HTTP_AUTHORIZATION=auth)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('ETag'))
+
     @mock.patch('radioco.apps.global_settings.models.PodcastConfiguration.get_global', PodcastMock._get_podcast_config_mock)
     def test_submit_recorder(self):
         self._login()
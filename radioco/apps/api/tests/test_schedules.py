@@ -1,17 +1,28 @@
 import datetime
+import json
+from StringIO import StringIO
+from collections import OrderedDict
 
 import mock
 import pytz
+from django.core.management import call_command
 from rest_framework import status
+from rest_framework.renderers import JSONRenderer
 from rest_framework.test import APITestCase
 
+from radioco.apps.api import transmissions_cache
 from radioco.apps.radioco.test_utils import TestDataMixin
+from radioco.apps.schedules.models import Transmission
 
 
 def mock_now():
     return pytz.utc.localize(datetime.datetime(2015, 1, 6, 14, 30, 0))
 
 
+def _data(response):
+    return json.loads(b''.join(response.streaming_content))
+
+
 class TestSchedulesAPI(TestDataMixin, APITestCase):
     def test_schedules_get_all(self):
         response = self.client.get('/api/2/schedules')
@@ -67,8 +78,9 @@ class TestTransmissionAPI(TestDataMixin, APITestCase):
                 'before': datetime.date(2015, 2, 7),
             })
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = _data(response)
         self.assertEqual(
-            {_key: response.data[0][_key] for _key in response.data[0] if _key not in ['schedule', 'programme', 'id']},
+            {_key: data[0][_key] for _key in data[0] if _key not in ['schedule', 'programme', 'id']},
             {
                 'end': '2015-02-01T09:00:00Z', 'name': 'Morning News',
                 'programme_url': 'http://testserver/programmes/morning-news/',
@@ -87,8 +99,9 @@ class TestTransmissionAPI(TestDataMixin, APITestCase):
                 'timezone': 'Europe/Madrid'
             })
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+        data = _data(response)
         self.assertEqual(
-            {_key: response.data[0][_key] for _key in response.data[0] if _key not in ['schedule', 'programme', 'id']},
+            {_key: data[0][_key] for _key in data[0] if _key not in ['schedule', 'programme', 'id']},
             {
                 'end': '2015-02-01T10:00:00+01:00', 'name': u'Morning News',
                 'programme_url': u'http://testserver/programmes/morning-news/',
@@ -129,7 +142,7 @@ class TestTransmissionAPI(TestDataMixin, APITestCase):
             })
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertListEqual(
-            map(lambda t: (t['slug'], t['start']), response.data),
+            map(lambda t: (t['slug'], t['start']), _data(response)),
             [('classic-hits', '2015-01-06T16:30:00Z')])
 
     def test_transmission_same_day(self):
@@ -141,7 +154,7 @@ class TestTransmissionAPI(TestDataMixin, APITestCase):
             })
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(
-            sorted(response.data, key=lambda t: t['start'])[0]['start'],
+            sorted(_data(response), key=lambda t: t['start'])[0]['start'],
             '2015-02-01T08:00:00Z')
 
     @mock.patch('django.utils.timezone.now', mock_now)
@@ -151,9 +164,135 @@ class TestTransmissionAPI(TestDataMixin, APITestCase):
             {'after': datetime.date(2015, 1, 14), 'before': datetime.date(2015, 1, 14)})
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(
-            sorted(response.data, key=lambda t: t['start'])[-1]['start'],
+            sorted(_data(response), key=lambda t: t['start'])[-1]['start'],
             '2015-01-14T14:00:00Z')
 
+    def test_transmissions_streaming(self):
+        params = {'after': datetime.date(2015, 1, 1), 'before': datetime.date(2015, 2, 1), 'timezone': 'Europe/Madrid'}
+        response = self.client.get('/api/2/transmissions', params)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        content = b''.join(response.streaming_content)
+        self.assertEqual(content, JSONRenderer().render(json.loads(content, object_pairs_hook=OrderedDict)))
+
+        response = self.client.get('/api/2/transmissions', dict(params, format='api'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual(response.data, json.loads(content))
+
+    def test_transmissions_max_range(self):
+        response = self.client.get(
+            '/api/2/transmissions', {'after': datetime.date(2015, 1, 1), 'before': datetime.date(2025, 1, 1)})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_transmissions_cursor(self):
+        params = {'after': datetime.date(2015, 1, 1), 'before': datetime.date(2015, 1, 20)}
+        expected = _data(self.client.get('/api/2/transmissions', params))
+
+        transmissions = []
+        url, params = '/api/2/transmissions', dict(params, cursor='')
+        with mock.patch('radioco.apps.api.views.TRANSMISSIONS_PAGE_SIZE', 7):
+            while url:
+                response = self.client.get(url, params)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                page = _data(response)
+                self.assertLessEqual(len(page), 7)
+                transmissions.extend(page)
+                url, params = response.get('Link', '')[1:-len('>; rel="next"')], None
+        self.assertListEqual(transmissions, expected)
+
+        response = self.client.get(
+            '/api/2/transmissions', {'after': datetime.date(2015, 1, 1), 'before': datetime.date(2015, 1, 20),
+                                     'cursor': 'foo'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_transmissions_cursor_windows(self):
+        params = {'after': datetime.date(2015, 1, 1), 'before': datetime.date(2015, 1, 20)}
+        expected = _data(self.client.get('/api/2/transmissions', params))
+
+        transmissions = []
+        url, params = '/api/2/transmissions', dict(params, cursor='')
+        with mock.patch('radioco.apps.api.views.TRANSMISSIONS_PAGE_SIZE', 7), \
+                mock.patch('radioco.apps.api.views.TRANSMISSIONS_MAX_DAYS', 2), \
+                mock.patch.object(Transmission, 'between', wraps=Transmission.between) as between:
+            while url:
+                response = self.client.get(url, params)
+                transmissions.extend(_data(response))
+                url, params = response.get('Link', '')[1:-len('>; rel="next"')], None
+        self.assertListEqual(transmissions, expected)
+        # Every page only calculates the windows it needs
+        for _call in between.call_args_list:
+            self.assertLessEqual(_call[0][1] - _call[0][0], datetime.timedelta(days=2))
+
+    @mock.patch('radioco.apps.api.views.is_cache_shared', lambda: True)
+    def test_transmissions_etag(self):
+        params = {'after': datetime.date(2015, 1, 1), 'before': datetime.date(2015, 1, 7)}
+        response = self.client.get('/api/2/radiocom/transmissions', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        with mock.patch.object(Transmission, 'between') as between:
+            response = self.client.get('/api/2/radiocom/transmissions', params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertFalse(between.called)
+
+        response = self.client.get('/api/2/transmissions', params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.schedule.exclude_date(pytz.utc.localize(datetime.datetime(2015, 1, 3, 14, 0, 0)))
+        self.schedule.save()
+        response = self.client.get('/api/2/radiocom/transmissions', params, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_transmissions_etag_cache_not_shared(self):
+        params = {'after': datetime.date(2015, 1, 1), 'before': datetime.date(2015, 1, 7)}
+        with mock.patch('radioco.apps.api.views.is_cache_shared', lambda: False):
+            response = self.client.get('/api/2/transmissions', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.has_header('ETag'))
+
+    @mock.patch('radioco.apps.api.views.is_cache_shared', lambda: True)
+    def test_transmissions_cache(self):
+        transmissions_cache.reset_stats()
+        params = {'after': datetime.date(2015, 1, 1), 'before': datetime.date(2015, 1, 7)}
+        response = self.client.get('/api/2/transmissions', params)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        expected = _data(response)
+
+        with mock.patch.object(Transmission, 'between') as between:
+            response = self.client.get('/api/2/transmissions', params)
+            self.assertEqual(response['X-Cache'], 'HIT')
+            self.assertListEqual(_data(response), expected)
+
+            # Same period requested in other timezone
+            response = self.client.get('/api/2/transmissions', dict(params, timezone='Africa/Abidjan'))
+            self.assertEqual(response['X-Cache'], 'HIT')
+        self.assertFalse(between.called)
+        self.assertDictEqual(transmissions_cache.get_stats(), {'hits': 2, 'misses': 1})
+
+        response = self.client.get('/api/2/transmissions', dict(params, timezone='Europe/Madrid'))
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+        self.schedule.exclude_date(pytz.utc.localize(datetime.datetime(2015, 1, 3, 14, 0, 0)))
+        self.schedule.save()
+        response = self.client.get('/api/2/transmissions', params)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(_data(response)), len(expected) - 1)
+
+        out = StringIO()
+        call_command('transmissions_cache_stats', '--reset', stdout=out)
+        self.assertEqual(out.getvalue().strip(), 'Hits: 2, misses: 3 (40.0% hit ratio)')
+        self.assertDictEqual(transmissions_cache.get_stats(), {'hits': 0, 'misses': 0})
+
+    def test_transmissions_cache_not_shared(self):
+        params = {'after': datetime.date(2015, 1, 1), 'before': datetime.date(2015, 1, 7)}
+        with mock.patch('radioco.apps.api.views.is_cache_shared', lambda: False), \
+                mock.patch.object(transmissions_cache, 'get') as get, \
+                mock.patch.object(transmissions_cache, 'store') as store:
+            response = self.client.get('/api/2/transmissions', params)
+            _data(response)
+        self.assertFalse(response.has_header('X-Cache'))
+        self.assertFalse(get.called)
+        self.assertFalse(store.called)
+
     @mock.patch('django.utils.timezone.now', mock_now)
     def test_transmission_now(self):
         response = self.client.get('/api/2/transmissions/now')
@@ -162,6 +301,54 @@ class TestTransmissionAPI(TestDataMixin, APITestCase):
             (response.data['slug'], response.data['start']),
             ('classic-hits', '2015-01-06T14:00:00Z'))
 
+    @mock.patch('django.utils.timezone.now', mock_now)
+    def test_transmission_next(self):
+        response = self.client.get('/api/2/transmissions/next', {'limit': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertListEqual(
+            map(lambda t: (t['slug'], t['start']), response.data),
+            [('classic-hits', '2015-01-06T14:00:00Z'),
+             ('morning-news', '2015-01-07T08:00:00Z'),
+             ('places-to-go', '2015-01-07T10:00:00Z')])
+
+    def test_transmission_next_invalid_limit(self):
+        response = self.client.get('/api/2/transmissions/next', {'limit': 0})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @mock.patch('radioco.apps.api.views.is_cache_shared', lambda: True)
+    def test_transmission_now_cache(self):
+        with mock.patch('django.utils.timezone.now', mock_now):
+            response = self.client.get('/api/2/transmissions/now', {'timezone': 'Europe/Madrid'})
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response['Cache-Control'], 'max-age=1800')
+        self.assertEqual(response.data['start'], '2015-01-06T15:00:00+01:00')
+
+        with mock.patch('django.utils.timezone.now', lambda: mock_now() + datetime.timedelta(minutes=10)):
+            with mock.patch.object(Transmission, 'at') as at:
+                response = self.client.get('/api/2/transmissions/now')
+            self.assertFalse(at.called)
+            self.assertEqual(response['X-Cache'], 'HIT')
+            self.assertEqual(response['Cache-Control'], 'max-age=1200')
+            self.assertEqual(response.data['start'], '2015-01-06T14:00:00Z')
+
+            self.schedule.exclude_date(pytz.utc.localize(datetime.datetime(2015, 1, 6, 14, 0, 0)))
+            self.schedule.save()
+            response = self.client.get('/api/2/transmissions/now')
+            self.assertEqual(response['X-Cache'], 'MISS')
+            self.assertIsNone(response.data)
+
+    @mock.patch('django.utils.timezone.now', mock_now)
+    def test_transmission_now_cache_not_shared(self):
+        with mock.patch('radioco.apps.api.views.is_cache_shared', lambda: False), \
+                mock.patch.object(transmissions_cache, 'get') as get, \
+                mock.patch.object(transmissions_cache, 'store') as store:
+            response = self.client.get('/api/2/transmissions/now')
+        self.assertEqual(response.data['start'], '2015-01-06T14:00:00Z')
+        self.assertEqual(response['Cache-Control'], 'max-age=1800')
+        self.assertFalse(response.has_header('X-Cache'))
+        self.assertFalse(get.called)
+        self.assertFalse(store.called)
+
     def test_transmissions_filter_calendar_nonexistend(self):
         response = self.client.get(
             '/api/2/transmissions', {'calendar': 9999})
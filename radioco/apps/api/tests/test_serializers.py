@@ -0,0 +1,48 @@
+import datetime
+import json
+
+import pytz
+import recurrence
+from django.test import TestCase
+from django.utils.timezone import override
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from radioco.apps.api import serializers
+from radioco.apps.radioco.test_utils import TestDataMixin
+from radioco.apps.schedules.models import Schedule, Transmission
+
+
+class TestTransmissionListSerializer(TestDataMixin, TestCase):
+    def setUp(self):
+        Schedule.objects.create(
+            programme=self.programme, type='B', calendar=self.calendar, source=self.schedule,
+            recurrences=recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.DAILY)]),
+            start_dt=pytz.utc.localize(datetime.datetime(2015, 1, 1, 22, 0, 0)))
+        self.request = Request(APIRequestFactory().get('/api/2/transmissions'))
+        self.transmissions = list(Transmission.between(
+            pytz.utc.localize(datetime.datetime(2015, 1, 1)), pytz.utc.localize(datetime.datetime(2015, 2, 1))))
+
+    def _assert_same_output(self, serializer_class):
+        for tz in (pytz.utc, pytz.timezone('Europe/Madrid'), pytz.timezone('America/New_York')):
+            with override(timezone=tz):
+                serializer = serializer_class(self.transmissions, many=True, context={'request': self.request})
+                item_serializer = serializer_class(context={'request': self.request})
+                expected = [item_serializer.to_representation(_transmission) for _transmission in self.transmissions]
+                self.assertEqual(JSONRenderer().render(serializer.data), JSONRenderer().render(expected))
+
+    def test_transmission_serializer(self):
+        self.assertTrue(any(_transmission.episode for _transmission in self.transmissions))
+        self.assertTrue(any(_transmission.schedule.source_id for _transmission in self.transmissions))
+        self._assert_same_output(serializers.TransmissionSerializer)
+
+    def test_radiocom_transmission_serializer(self):
+        self._assert_same_output(serializers.RadiocomTransmissionSerializer)
+
+    def test_episode_url(self):
+        transmission = next(_transmission for _transmission in self.transmissions if _transmission.episode)
+        data = serializers.TransmissionSerializer([transmission], many=True, context={'request': self.request}).data
+        self.assertEqual(
+            json.loads(JSONRenderer().render(data))[0]['episode_url'],
+            self.request.build_absolute_uri(transmission.episode.get_absolute_url()))
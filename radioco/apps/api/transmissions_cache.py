@@ -0,0 +1,71 @@
+"""
+Shared cache of transmission lists
+
+Lists are stored without timezone (see TransmissionListSerializer.iter_neutral_representation) so the same entry is
+used for every requested timezone. Keys include the schedules version, old entries are never read again after a
+change and they expire after API_TRANSMISSIONS_CACHE_TIMEOUT seconds. It's only used if the cache is shared between
+processes, otherwise the version bumps made by other processes are not seen.
+"""
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+CACHE_TIMEOUT = getattr(settings, 'API_TRANSMISSIONS_CACHE_TIMEOUT', 60 * 60)
+# Bigger lists are not cached
+CACHE_MAX_ITEMS = getattr(settings, 'API_TRANSMISSIONS_CACHE_MAX_ITEMS', 2000)
+
+HITS_KEY = 'transmissions_cache_hits'
+MISSES_KEY = 'transmissions_cache_misses'
+
+
+def get_key(*parts):
+    key = '|'.join(unicode(_part) for _part in parts)
+    return 'transmissions:' + hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+def get(key):
+    """
+    Returns the cached value or None, counting hits and misses
+    """
+    items = cache.get(key)
+    _incr(MISSES_KEY if items is None else HITS_KEY)
+    return items
+
+
+def store(key, value, timeout=CACHE_TIMEOUT):
+    cache.set(key, value, timeout)
+
+
+def collect(items, key):
+    """
+    Yields the items and stores them in the cache when all of them were consumed
+    """
+    collected = []
+    for item in items:
+        if collected is not None:
+            collected.append(item)
+            if len(collected) > CACHE_MAX_ITEMS:
+                collected = None
+        yield item
+    if collected is not None:
+        store(key, collected)
+
+
+def get_stats():
+    return {
+        'hits': cache.get(HITS_KEY) or 0,
+        'misses': cache.get(MISSES_KEY) or 0,
+    }
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        if not cache.add(key, 1, None):
+            cache.incr(key)
@@ -1,23 +1,66 @@
 import datetime
+import hashlib
+from itertools import islice
 
 import django_filters
 import pytz
 from django import forms
 from django import utils
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_cache_control
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.utils.http import urlencode
 from django.utils.timezone import override
+from django.views.decorators.http import condition
 from recurrence import Recurrence
 from rest_framework import filters, permissions, viewsets
 from rest_framework.decorators import list_route
 from rest_framework.exceptions import ValidationError as DRFValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 import serializers
+from radioco.apps.api import transmissions_cache
 from radioco.apps.api.viewsets import UpdateOnlyModelViewSet
 from radioco.apps.global_settings.models import RadiocomConfiguration
 from radioco.apps.programmes.models import Programme, Episode
-from radioco.apps.schedules.models import Schedule, Transmission
+from radioco.apps.radioco.utils import is_cache_shared
+from radioco.apps.schedules.models import Calendar, Schedule, Transmission
+from radioco.apps.schedules.utils import coalesce_rearrangements, get_schedules_version
+
+DEFAULT_UPCOMING_TRANSMISSIONS = 10
+MAX_UPCOMING_TRANSMISSIONS = 100
+# Longest period of time which can be requested at once, use the cursor for bigger periods
+TRANSMISSIONS_MAX_DAYS = getattr(settings, 'API_TRANSMISSIONS_MAX_DAYS', 366)
+TRANSMISSIONS_PAGE_SIZE = getattr(settings, 'API_TRANSMISSIONS_PAGE_SIZE', 1000)
+# Number of items rendered in each chunk of streaming responses
+STREAMING_CHUNK_SIZE = 100
+
+
+def schedules_etag(request, *args, **kwargs):
+    """
+    ETag of read only requests, it changes when the schedules version or the request parameters do
+    It's only sent if the cache is shared, otherwise changes made by other processes can't be detected
+    """
+    if request.method not in ('GET', 'HEAD') or not is_cache_shared():
+        return None
+    version = get_schedules_version()
+    if version is None:
+        return None
+    key = '|'.join([
+        str(version), request.path, urlencode(sorted(request.GET.lists()), doseq=True),
+        request.META.get('HTTP_ACCEPT', ''), request.META.get('HTTP_ACCEPT_LANGUAGE', '')
+    ])
+    return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+
+# Answers 304 without running the view if the ETag matches
+schedules_condition = method_decorator(condition(etag_func=schedules_etag))
 
 
 class ProgrammeFilter(filters.FilterSet):
@@ -46,6 +89,11 @@ class ProgrammeViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.ProgrammeSerializer
     lookup_field = 'slug'
 
+    @schedules_condition
+    def retrieve(self, request, *args, **kwargs):
+        return super(ProgrammeViewSet, self).retrieve(request, *args, **kwargs)
+
+    @schedules_condition
     def list(self, request, *args, **kwargs):
         data = ProgrammeFilterForm(request.query_params)
         if not data.is_valid():
@@ -114,21 +162,103 @@ class TransmissionForm(TimezoneForm):
     after = forms.DateField()
     before = forms.DateField()
     calendar = forms.CharField(required=False)
+    cursor = forms.CharField(required=False)
+
+    def clean_cursor(self):
+        cursor = self.cleaned_data.get('cursor')
+        if not cursor:
+            return None
+        try:
+            cursor = parse_datetime(cursor)
+        except ValueError:
+            cursor = None
+        if not cursor or not cursor.tzinfo:
+            raise ValidationError('cursor has to be the start of a transmission.')
+        return cursor
 
     def clean(self):
         cleaned_data = super(TransmissionForm, self).clean()
         if cleaned_data.get('before') and cleaned_data.get('after'):
             if cleaned_data['after'] > cleaned_data['before']:
                 raise ValidationError('after date has to be greater or equals than before date.')
+            is_paginated = 'cursor' in self.data
+            if not is_paginated and (cleaned_data['before'] - cleaned_data['after']).days >= TRANSMISSIONS_MAX_DAYS:
+                raise ValidationError(
+                    'The period can not be longer than {days} days, use the cursor parameter to paginate.'.format(
+                        days=TRANSMISSIONS_MAX_DAYS))
         return cleaned_data
 
 
+def _render_json_stream(items):
+    """
+    Renders a list as JSON, rendering only a few items at a time
+    """
+    renderer = JSONRenderer()
+    items = iter(items)
+    chunk = list(islice(items, STREAMING_CHUNK_SIZE))
+    yield b'[' + b','.join(renderer.render(_item) for _item in chunk)
+    while True:
+        chunk = list(islice(items, STREAMING_CHUNK_SIZE))
+        if not chunk:
+            break
+        yield b',' + b','.join(renderer.render(_item) for _item in chunk)
+    yield b']'
+
+
+def _seconds_until(date, now):
+    if not date:
+        return transmissions_cache.CACHE_TIMEOUT
+    return int((date - now).total_seconds())
+
+
+def _between_by_windows(after, before, schedules):
+    """
+    Transmissions between two dates, calculated in windows of TRANSMISSIONS_MAX_DAYS days
+    Later windows are only calculated if the previous ones are consumed
+    """
+    window_after = after
+    while True:
+        window_before = min(before, window_after + datetime.timedelta(days=TRANSMISSIONS_MAX_DAYS))
+        is_last = window_before >= before
+        for transmission in Transmission.between(window_after, window_before, schedules=schedules):
+            # Transmissions crossing the limit of a window are only included in the window where they start
+            if window_after != after and transmission.start < window_after:
+                continue
+            if not is_last and transmission.start >= window_before:
+                continue
+            yield transmission
+        if is_last:
+            return
+        window_after = window_before
+
+
+def _page(transmissions, cursor):
+    """
+    Returns the transmissions which start after the cursor, up to the page size
+    Transmissions sharing the start of the last one are included, so the next cursor doesn't skip any of them
+    """
+    page = []
+    for transmission in transmissions:
+        if cursor and transmission.start <= cursor:
+            continue
+        if len(page) >= TRANSMISSIONS_PAGE_SIZE and transmission.start != page[-1].start:
+            return page, True
+        page.append(transmission)
+    return page, False
+
+
+class UpcomingTransmissionForm(TimezoneForm):
+    limit = forms.IntegerField(required=False, min_value=1, max_value=MAX_UPCOMING_TRANSMISSIONS)
+    calendar = forms.CharField(required=False)
+
+
 class TransmissionViewSet(viewsets.ReadOnlyModelViewSet):
     queryset = Schedule.objects.all()
     filter_backends = (filters.DjangoFilterBackend,)  # Transmissions are always order by date
     filter_class = ScheduleFilter
     serializer_class = serializers.TransmissionSerializer
 
+    @schedules_condition
     def list(self, request, *args, **kwargs):
         data = TransmissionForm(request.query_params)
         if not data.is_valid():
@@ -146,13 +276,72 @@ class TransmissionViewSet(viewsets.ReadOnlyModelViewSet):
         schedules = self.filter_queryset(self.get_queryset())
         # Filter by active calendar if that filter was not provided
         if not data.cleaned_data.get('calendar'):
-            schedules = schedules.filter(calendar__is_active=True)
-
-        transmissions = Transmission.between(
-            after_date,
-            before_date,
-            schedules=schedules
+            schedules = schedules.filter(calendar_id=Calendar.get_active_id())
+
+        headers = {}
+        cursor = data.cleaned_data.get('cursor')
+        is_paginated = 'cursor' in request.query_params
+        items, cache_key = None, None
+        version = get_schedules_version() if is_cache_shared() else None
+        if not is_paginated and version is not None:
+            # Timezone neutral lists are shared between requests
+            query_filters = sorted(
+                (_key, _value) for _key, _value in request.query_params.lists()
+                if _key not in ('after', 'before', 'timezone', 'format')
+            )
+            cache_key = transmissions_cache.get_key(
+                version, self.get_serializer_class().__name__, request.build_absolute_uri('/'),
+                after_date.astimezone(pytz.utc).isoformat(), before_date.astimezone(pytz.utc).isoformat(), query_filters
+            )
+            items = transmissions_cache.get(cache_key)
+            headers['X-Cache'] = 'MISS' if items is None else 'HIT'
+
+        serializer = self.get_serializer([], many=True)
+        if items is None:
+            if is_paginated:
+                transmissions = _between_by_windows(
+                    max(after_date, cursor) if cursor else after_date, before_date, schedules
+                )
+                transmissions, has_next = _page(transmissions, cursor)
+                if has_next:
+                    next_cursor = transmissions[-1].start.isoformat()
+                    headers['Link'] = '<{url}>; rel="next"'.format(
+                        url=replace_query_param(request.build_absolute_uri(), 'cursor', next_cursor))
+            else:
+                transmissions = Transmission.between(after_date, before_date, schedules=schedules)
+            items = serializer.iter_neutral_representation(transmissions)
+            if cache_key:
+                items = transmissions_cache.collect(items, cache_key)
+        items = serializer.localize(items, tz)
+
+        if request.accepted_renderer.format != 'json':
+            return Response(list(items), headers=headers)
+
+        # Transmissions are serialized while they are generated
+        response = StreamingHttpResponse(
+            _render_json_stream(items), content_type=request.accepted_renderer.media_type
         )
+        for header, value in headers.items():
+            response[header] = value
+        return response
+
+    @list_route(url_path='next')
+    def upcoming(self, request):
+        data = UpcomingTransmissionForm(request.query_params)
+        if not data.is_valid():
+            raise DRFValidationError(data.errors)
+        requested_timezone = data.cleaned_data.get('timezone')
+        limit = data.cleaned_data.get('limit') or DEFAULT_UPCOMING_TRANSMISSIONS
+
+        # Apply filters to the queryset
+        schedules = self.filter_queryset(self.get_queryset())
+        # Filter by active calendar if that filter was not provided
+        if not data.cleaned_data.get('calendar'):
+            schedules = schedules.filter(calendar_id=Calendar.get_active_id())
+
+        tz = requested_timezone or pytz.utc
+        now = utils.timezone.now()
+        transmissions = Transmission.upcoming(now, limit, schedules=schedules)
         serializer = self.get_serializer(transmissions, many=True)
         with override(timezone=tz):
             return Response(serializer.data)
@@ -166,15 +355,32 @@ class TransmissionViewSet(viewsets.ReadOnlyModelViewSet):
 
         tz = requested_timezone or pytz.utc
         now = utils.timezone.now()
-        transmissions = Transmission.at(now)
-        try:
-            transmission = transmissions.next()
-        except StopIteration:
-            return Response(None)
-        else:
-            serializer = self.get_serializer(transmission, many=False)
-            with override(timezone=tz):
-                return Response(serializer.data)
+        serializer = self.get_serializer([], many=True)
+        cached, cache_key = None, None
+        version = get_schedules_version() if is_cache_shared() else None
+        if version is not None:
+            # The answer doesn't change until the next transmission starts or ends
+            cache_key = transmissions_cache.get_key(
+                'now', version, self.get_serializer_class().__name__, request.build_absolute_uri('/'))
+            cached = transmissions_cache.get(cache_key)
+        is_cached = cached is not None
+
+        if cached is None:
+            transmission = next(Transmission.at(now), None)
+            items = list(serializer.iter_neutral_representation([transmission] if transmission else []))
+            cached = (items, Transmission.next_change(now))
+            if cache_key:
+                timeout = _seconds_until(cached[1], now)
+                if timeout > 0:
+                    transmissions_cache.store(cache_key, cached, timeout)
+
+        items, next_change = cached
+        items = list(serializer.localize(items, tz))
+        response = Response(items[0] if items else None)
+        patch_cache_control(response, max_age=max(_seconds_until(next_change, now), 0))
+        if cache_key:
+            response['X-Cache'] = 'HIT' if is_cached else 'MISS'
+        return response
 
 
 class RadiocomTransmissionViewSet(TransmissionViewSet):
@@ -194,6 +400,7 @@ class TransmissionOperationViewSet(UpdateOnlyModelViewSet):
         self.perform_update(serializer)
         return Response('ok')
 
+    @coalesce_rearrangements()
     def perform_update(self, serializer):
         schedule = serializer.instance
         start = serializer.validated_data['start']
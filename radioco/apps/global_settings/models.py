@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import copy
 import datetime
 
 from django.conf import settings
@@ -25,6 +26,7 @@ from django.utils.translation import ugettext as _u
 from django.utils.translation import ugettext_lazy as _
 from rest_framework.authtoken.models import Token
 
+from radioco.apps.radioco import local_cache
 from radioco.apps.schedules.models import WEEKDAY_CHOICES
 
 
@@ -41,12 +43,18 @@ class SingletonModel(models.Model):
         self.pk = 1
         super(SingletonModel, self).save(*args, **kwargs)
         self._set_cache(self)
+        local_cache.invalidate()
 
     def delete(self, *args, **kwargs):
         pass
 
     @classmethod
     def get_global(cls):
+        # The instance kept in memory is shared, callers get their own copy
+        return copy.deepcopy(local_cache.get(cls.__name__, cls._load))
+
+    @classmethod
+    def _load(cls):
         obj = cls._get_cache()
         if not obj:
             obj, created = cls.objects.get_or_create(pk=1)
@@ -295,9 +295,7 @@ class NonStaffEpisodeAdmin(admin.ModelAdmin):
             else:
                 after = now
             date = next_dates(Calendar.get_active(), programme, after).next()
-            Episode.objects.create_episode(
-                episode=obj, last_episode=last_episode,
-                date=date, programme=programme)
+            Episode.objects.create_episode(episode=obj, date=date, programme=programme)
         else:
             obj.save()
 
@@ -21,24 +21,27 @@ from django.contrib.auth.models import User
 from django.core.exceptions import FieldError
 from django.core.urlresolvers import reverse
 from django.core.validators import MinValueValidator
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Q, Max
 from django.db.models.signals import post_save, pre_save
 from django.template.defaultfilters import slugify
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 import datetime
 
-from radioco.apps.radioco.utils import field_has_changed
-from radioco.apps.schedules.utils import next_dates
+from radioco.apps.radioco.utils import DirtyFieldsMixin, update_in_batches
+from radioco.apps.schedules.utils import next_dates, bump_schedules_version
 
 if hasattr(settings, 'PROGRAMME_LANGUAGES'):
     PROGRAMME_LANGUAGES = settings.PROGRAMME_LANGUAGES
 else:
     PROGRAMME_LANGUAGES = settings.LANGUAGES
 
+# Maximum number of (programme, issue_date) pairs looked up in a single query
+LOOKUP_BATCH_SIZE = 400
 
-class Programme(models.Model):
+
+class Programme(DirtyFieldsMixin, models.Model):
     class Meta:
         verbose_name = _('programme')
         verbose_name_plural = _('programmes')
@@ -128,30 +131,26 @@ class Programme(models.Model):
     def rearrange_episodes(self, after, calendar):
         """
         Update the issue_date of episodes from a given date
-        """
-        episodes = Episode.objects.unfinished(self, after)
-        dates = next_dates(calendar, self, after)
-
-        # Further dates and episodes available -> re-order
-        while True:
-            try:
-                date = dates.next()
-                episode = episodes.next()
-            except StopIteration:
-                break
-            else:
-                episode.issue_date = date
-                episode.save()
+        Only the episodes whose issue_date changes are updated
 
+        Returns: the number of episodes moved
+        """
+        episodes = list(Episode.objects.unfinished(self, after))
+        if not episodes:
+            return 0
+        dates = list(next_dates(calendar, self, after, limit=len(episodes)))
         # No further dates available -> unschedule
-        while True:
-            try:
-                episode = episodes.next()
-            except StopIteration:
-                break
-            else:
-                episode.issue_date = None
-                episode.save()
+        dates.extend([None] * (len(episodes) - len(dates)))
+
+        moved = []
+        for episode, date in zip(episodes, dates):
+            if episode.issue_date != date:
+                episode.issue_date = date
+                moved.append(episode)
+        if moved:
+            update_in_batches(Episode, moved, ['issue_date'])
+            bump_schedules_version()
+        return len(moved)
 
     def get_absolute_url(self):
         return reverse('programmes:detail', args=[self.slug])
@@ -161,14 +160,12 @@ class Programme(models.Model):
 
 
 def update_schedule_performance(programme):
-    for schedule in programme.schedule_set.all():
-        # schedule.effective_start_dt = calculate_effective_schedule_start_dt(schedule)
-        # schedule.effective_end_dt = calculate_effective_schedule_end_dt(schedule)
-        schedule.save()  # TODO: improve performance, update objects in bulk? We need custom logic on save
+    from radioco.apps.schedules.models import update_effective_dates
+    update_effective_dates(programme.schedule_set.all())
 
 
 def update_schedule_if_dt_has_changed(sender, instance, **kwargs):
-    if field_has_changed(instance, 'start_date') or field_has_changed(instance, 'end_date'):  # TODO: improve
+    if instance.pk and instance.changed_fields & {'start_date', 'end_date'}:
         update_schedule_performance(instance)
 
 
@@ -177,31 +174,117 @@ pre_save.connect(
 
 
 class EpisodeManager(models.Manager):
-    # XXX this is not atomic, transaction?
-    def create_episode(self, date, programme, last_episode=None, episode=None):
-        if not last_episode:
-            last_episode = self.last(programme)
-        season = programme.current_season
-        if last_episode and last_episode.season == season:
-            number_in_season = last_episode.number_in_season + 1
-        else:
-            number_in_season = 1
-        if episode:
-            episode.programme = programme
-            episode.issue_date = date
-            episode.season = season
-            episode.number_in_season = number_in_season
-        else:
-            episode = Episode(
-                programme=programme, issue_date=date, season=season, number_in_season=number_in_season
-            )
-        episode.save()
-        for role in Role.objects.filter(programme=programme):
-            Participant.objects.create(
-                person=role.person, episode=episode, role=role.role, description=role.description
+    def create_episode(self, date, programme, episode=None):
+        with transaction.atomic():
+            season, number_in_season = self.lock_last_numbers([programme]).get(programme.id, (None, 0))
+            if season != programme.current_season:
+                number_in_season = 0
+            if episode:
+                episode.programme = programme
+                episode.issue_date = date
+                episode.season = programme.current_season
+                episode.number_in_season = number_in_season + 1
+            else:
+                episode = Episode(
+                    programme=programme, issue_date=date,
+                    season=programme.current_season, number_in_season=number_in_season + 1
+                )
+            episode.save()
+            Participant.objects.bulk_create(
+                Participant(person_id=_role.person_id, episode=episode, role=_role.role, description=_role.description)
+                for _role in Role.objects.filter(programme=programme)
             )
         return episode
 
+    def create_episodes(self, items):
+        """
+        Creates the episodes of the given (issue_date, programme) pairs in a single transaction
+        Seasons are numbered in memory and episodes and participants are inserted in bulk
+
+        Returns: a tuple of a dict of the episodes keyed by (programme_id, issue_date), including the ones created
+        meanwhile by other processes, and the number of episodes created by this call
+        """
+        items = sorted(set((_date, _programme) for _date, _programme in items), key=lambda _item: _item[0])
+        if not items:
+            return {}, 0
+        programme_ids = set(_programme.id for _date, _programme in items)
+
+        with transaction.atomic():
+            last_numbers = self.lock_last_numbers(_programme for _date, _programme in items)
+            # Other processes could have created some of them while waiting for the lock
+            existing = self.by_issue_date((_programme.id, _date) for _date, _programme in items)
+
+            episodes = []
+            for date, programme in items:
+                if (programme.id, date) in existing:
+                    continue
+                season, number_in_season = last_numbers.get(programme.id, (None, 0))
+                if season != programme.current_season:
+                    number_in_season = 0
+                last_numbers[programme.id] = (programme.current_season, number_in_season + 1)
+                episodes.append(Episode(
+                    programme=programme, issue_date=date,
+                    season=programme.current_season, number_in_season=number_in_season + 1
+                ))
+            if not episodes:
+                return existing, 0
+            self.bulk_create(episodes)
+
+            # Primary keys are not set by bulk_create
+            created = self.by_issue_date((_episode.programme_id, _episode.issue_date) for _episode in episodes)
+            roles = {}
+            for role in Role.objects.filter(programme_id__in=programme_ids):
+                roles.setdefault(role.programme_id, []).append(role)
+            Participant.objects.bulk_create(
+                Participant(person_id=_role.person_id, episode=_episode, role=_role.role, description=_role.description)
+                for _episode in created.values() for _role in roles.get(_episode.programme_id, [])
+            )
+        # Signals are not sent by bulk_create
+        bump_schedules_version()
+        existing.update(created)
+        return existing, len(episodes)
+
+    @staticmethod
+    def lock_last_numbers(programmes):
+        """
+        Locks the given programmes until the end of the current transaction and returns the season and number of
+        their last episodes, keyed by programme id
+
+        Numbers following them can be handed out safely, concurrent writers wait for the lock
+        """
+        programme_ids = sorted(set(_programme.id for _programme in programmes))
+        # Locking always in the same order to avoid deadlocks
+        list(Programme.objects.select_for_update().filter(id__in=programme_ids).order_by('id').values_list('id'))
+
+        last_numbers = {}
+        numbers = Episode.objects.filter(
+            programme_id__in=programme_ids
+        ).values('programme_id', 'season').annotate(number=Max('number_in_season'))
+        for row in numbers:
+            # Emulating last(), the highest number of the highest season
+            if row['season'] > last_numbers.get(row['programme_id'], (0, 0))[0]:
+                last_numbers[row['programme_id']] = (row['season'], row['number'])
+        return last_numbers
+
+    def by_issue_date(self, keys):
+        """
+        Returns a dict of episodes keyed by (programme_id, issue_date)
+        Only the episodes matching the given keys are returned, querying them in batches
+        """
+        keys = list(set(keys))
+        episodes = {}
+        for index in range(0, len(keys), LOOKUP_BATCH_SIZE):
+            batch = set(keys[index:index + LOOKUP_BATCH_SIZE])
+            queryset = self.filter(
+                programme_id__in=set(_programme_id for _programme_id, _date in batch),
+                issue_date__in=set(_date for _programme_id, _date in batch)
+            )
+            for episode in queryset:
+                key = (episode.programme_id, episode.issue_date)
+                if key in batch:
+                    episodes[key] = episode
+        return episodes
+
     @staticmethod
     def last(programme):
         return (programme.episode_set
@@ -15,6 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import datetime
 
+import mock
 import pytz
 from django.contrib.admin.options import ModelAdmin
 from django.contrib.admin.sites import AdminSite
@@ -124,6 +125,31 @@ class EpisodeManagerTests(TestDataMixin, TestCase):
         episode = self.manager.last(Programme())
         self.assertIsNone(episode)
 
+    def test_create_episodes(self):
+        dates = [pytz.utc.localize(datetime.datetime(2014, 6, _day, 10, 0, 0)) for _day in (16, 15)]
+        episodes, created = Episode.objects.create_episodes((_date, self.programme) for _date in dates)
+        self.assertEqual(created, 2)
+        self.assertListEqual(
+            [(episodes[(self.programme.id, _date)].season, episodes[(self.programme.id, _date)].number_in_season)
+             for _date in sorted(dates)],
+            [(7, 7), (7, 8)])
+        self.assertQuerysetEqual(
+            episodes[(self.programme.id, dates[0])].people.all(), self.programme.announcers.all())
+
+    def test_create_existing_episodes(self):
+        date = pytz.utc.localize(datetime.datetime(2014, 6, 15, 10, 0, 0))
+        episode = Episode.objects.create_episodes([(date, self.programme)])[0][(self.programme.id, date)]
+        self.assertTupleEqual(
+            Episode.objects.create_episodes([(date, self.programme)]), ({(self.programme.id, date): episode}, 0))
+        self.assertEqual(Episode.objects.filter(programme=self.programme, issue_date=date).count(), 1)
+
+    def test_lock_last_numbers(self):
+        with mock.patch.object(
+                Programme.objects, 'select_for_update', wraps=Programme.objects.select_for_update) as lock:
+            last_numbers = self.manager.lock_last_numbers([self.programme])
+        self.assertTrue(lock.called)
+        self.assertDictEqual(last_numbers, {self.programme.id: (7, 6)})
+
     def test_unfinished(self):
         episodes = self.manager.unfinished(
             self.programme, pytz.utc.localize(datetime.datetime(2015, 1, 1)))
@@ -0,0 +1,74 @@
+"""
+Process-local cache for objects which rarely change, like the global settings or the active calendar
+
+Values are kept in memory along with the version of the shared cache they were loaded with. The version is read at
+most once per request (on every access outside of requests), so changes saved by any process are seen by the rest
+in their next request. Values are always loaded if the cache is not shared between processes (e.g. LocMemCache).
+"""
+import threading
+
+from django.core.signals import request_started, request_finished
+
+from radioco.apps.radioco.utils import get_cache_version, bump_cache_version, is_cache_shared
+
+VERSION_KEY = 'local_cache_version'
+
+_values = {}
+_request = threading.local()
+
+
+def get(name, load):
+    """
+    Returns the value stored under the given name, calling load() if it is missing or outdated
+    """
+    if not is_cache_shared():
+        # Changes made by other processes can't be detected
+        return load()
+    version = get_version()
+    if version is None:
+        return load()
+    entry = _values.get(name)
+    if entry is not None and entry[0] == version:
+        return entry[1]
+    value = load()
+    _values[name] = (version, value)
+    return value
+
+
+def get_version():
+    version = getattr(_request, 'version', None)
+    if version is None:
+        version = get_cache_version(VERSION_KEY)
+        if getattr(_request, 'active', False):
+            _request.version = version
+    return version
+
+
+def invalidate():
+    """
+    Outdates the values stored by every process
+    """
+    clear()
+    bump_cache_version(VERSION_KEY)
+
+
+def clear():
+    """
+    Forgets the values stored by this process
+    """
+    _request.version = None
+    _values.clear()
+
+
+def _request_started(sender, **kwargs):
+    _request.active = True
+    _request.version = None
+
+
+def _request_finished(sender, **kwargs):
+    _request.active = False
+    _request.version = None
+
+
+request_started.connect(_request_started, dispatch_uid='local_cache_request_started')
+request_finished.connect(_request_finished, dispatch_uid='local_cache_request_finished')
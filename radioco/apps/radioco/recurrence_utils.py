@@ -0,0 +1,406 @@
+"""
+Faster evaluation of recurrences
+
+django-recurrence iterates every occurrence from dtstart to answer before/after/between queries. DAILY and WEEKLY
+rules (optionally with BYDAY, INTERVAL, UNTIL and COUNT) can be evaluated arithmetically instead, the results are
+exactly the same that dateutil would return, including the tzinfo of the occurrences.
+Other rules can start iterating from the nearest checkpoint instead of dtstart.
+"""
+import bisect
+import calendar
+import copy
+import datetime
+import hashlib
+import json
+
+import dateutil.rrule
+import pytz
+import recurrence
+
+SIMPLE_FREQUENCIES = (recurrence.DAILY, recurrence.WEEKLY)
+SIMPLE_BYPARAMS = ('byday', )
+
+ONE_DAY = datetime.timedelta(days=1)
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
+CHECKPOINTS_STEP = datetime.timedelta(days=30)
+
+
+class NotSimpleRecurrence(Exception):
+    """
+    The recurrence can't be evaluated in closed form
+    """
+    pass
+
+
+def _weekday_number(weekday):
+    if isinstance(weekday, (int, long)):
+        return weekday
+    if getattr(weekday, 'index', None):
+        raise NotSimpleRecurrence('nth weekdays are not supported')
+    return weekday.number
+
+
+def _to_naive(dt, offset):
+    """
+    Returns the wall clock of a datetime in a fixed offset
+    """
+    if not dt.tzinfo:
+        raise NotSimpleRecurrence('naive datetimes are not supported')
+    return dt.astimezone(pytz.utc).replace(tzinfo=None) + offset
+
+
+class SimpleRule(object):
+    """
+    Arithmetic representation of a DAILY or WEEKLY rule
+
+    Occurrences are dates `base + period * n + days[j]` (at the time of dtstart) which are not before dtstart.
+    All the calculations are done in the wall clock of dtstart, as dateutil does.
+    """
+
+    def __init__(self, rule, start_dt):
+        if rule.freq not in SIMPLE_FREQUENCIES:
+            raise NotSimpleRecurrence('frequency not supported')
+        for param in rule.byparams:
+            if getattr(rule, param, None) and param not in SIMPLE_BYPARAMS:
+                raise NotSimpleRecurrence('%s is not supported' % param)
+        interval = rule.interval or 1
+        if interval < 1:
+            raise NotSimpleRecurrence('invalid interval')
+
+        self.tzinfo = start_dt.tzinfo
+        self.offset = start_dt.utcoffset()
+        self.start = start_dt.replace(tzinfo=None)
+        self.time = self.start.time()
+        self.count = rule.count or None
+        self.until = _to_naive(rule.until, self.offset) if rule.until else None
+
+        start_date = self.start.date()
+        if rule.freq == recurrence.WEEKLY:
+            wkst = calendar.firstweekday() if rule.wkst is None else _weekday_number(rule.wkst)
+            weekdays = set(_weekday_number(_weekday) for _weekday in rule.byday) or {start_date.weekday()}
+            self.base = start_date - datetime.timedelta(days=(start_date.weekday() - wkst) % 7)
+            self.period = 7 * interval
+            self.days = sorted((_weekday - wkst) % 7 for _weekday in weekdays)
+        else:
+            if rule.byday:
+                raise NotSimpleRecurrence('byday is only supported on weekly rules')
+            self.base = start_date
+            self.period = interval
+            self.days = [0]
+        # Occurrences of the first period which happen before dtstart
+        self.skipped = bisect.bisect_left(self.days, (start_date - self.base).days)
+        self.last_position = self._last_position()
+
+    def _date(self, position):
+        period, index = divmod(position, len(self.days))
+        return self.base + datetime.timedelta(days=period * self.period + self.days[index])
+
+    def _position_after(self, date):
+        """
+        Position of the first occurrence in or after date
+        """
+        period, rest = divmod((date - self.base).days, self.period)
+        return period * len(self.days) + bisect.bisect_left(self.days, rest)
+
+    def _position_before(self, date):
+        """
+        Position of the last occurrence in or before date
+        """
+        period, rest = divmod((date - self.base).days, self.period)
+        return period * len(self.days) + bisect.bisect_right(self.days, rest) - 1
+
+    def _last_position(self):
+        last_position = None
+        if self.count:
+            last_position = self.skipped + self.count - 1
+        if self.until is not None:
+            until_date = self.until.date()
+            if self.until.time() < self.time:
+                until_date -= ONE_DAY
+            until_position = self._position_before(until_date)
+            if last_position is None or until_position < last_position:
+                last_position = until_position
+        return last_position
+
+    def _occurrence(self, position):
+        return datetime.datetime.combine(self._date(position), self.time)
+
+    def after(self, dt):
+        """
+        Returns the first naive occurrence greater or equal than the naive dt
+        """
+        date = max(dt, self.start).date()
+        if datetime.datetime.combine(date, self.time) < dt:
+            date += ONE_DAY
+        position = max(self._position_after(date), self.skipped)
+        if self.last_position is not None and position > self.last_position:
+            return None
+        return self._occurrence(position)
+
+    def before(self, dt):
+        """
+        Returns the last naive occurrence smaller or equal than the naive dt
+        """
+        date = dt.date()
+        if datetime.datetime.combine(date, self.time) > dt:
+            date -= ONE_DAY
+        position = self._position_before(date)
+        if self.last_position is not None:
+            position = min(position, self.last_position)
+        if position < self.skipped:
+            return None
+        return self._occurrence(position)
+
+    def positions_between(self, after, before):
+        """
+        Returns the positions of the first and last naive occurrences between after and before (both included)
+        The first position is greater than the last one when there are no occurrences
+        """
+        date = max(after, self.start).date()
+        if datetime.datetime.combine(date, self.time) < after:
+            date += ONE_DAY
+        first_position = max(self._position_after(date), self.skipped)
+
+        date = before.date()
+        if datetime.datetime.combine(date, self.time) > before:
+            date -= ONE_DAY
+        last_position = self._position_before(date)
+        if self.last_position is not None:
+            last_position = min(last_position, self.last_position)
+        return first_position, last_position
+
+    def aware(self, dt):
+        return dt.replace(tzinfo=self.tzinfo)
+
+
+class SimpleRecurrence(object):
+    """
+    Closed-form equivalent of `recurrence.to_dateutil_rruleset(dtstart=start_dt)`
+    """
+
+    def __init__(self, _recurrence, start_dt):
+        if _recurrence.exrules or _recurrence.dtend:
+            raise NotSimpleRecurrence('exrules or dtend are not supported')
+        if not start_dt.tzinfo or start_dt.microsecond:
+            raise NotSimpleRecurrence('invalid start_dt')
+        self.rules = [SimpleRule(_rrule, start_dt) for _rrule in _recurrence.rrules]
+
+        rdates = list(_recurrence.rdates)
+        if getattr(_recurrence, 'include_dtstart', True):
+            rdates.append(start_dt)
+        for _dt in rdates + list(_recurrence.exdates):
+            if not _dt.tzinfo:
+                raise NotSimpleRecurrence('naive datetimes are not supported')
+        self.rdates = sorted(rdates)
+        for _dt, _next_dt in zip(self.rdates, self.rdates[1:]):
+            self._pick([_dt, _next_dt], min)
+        self.exdates = frozenset(_recurrence.exdates)
+
+    def _candidates(self, get_occurrence, dt):
+        candidates = []
+        for rule in self.rules:
+            naive_dt = _to_naive(dt, rule.offset)
+            occurrence = get_occurrence(rule, naive_dt)
+            if occurrence is not None:
+                candidates.append(rule.aware(occurrence))
+        return candidates
+
+    def _pick(self, candidates, pick):
+        if not candidates:
+            return None
+        value = pick(candidates)
+        # dateutil would return any of them, the representation could be different
+        for candidate in candidates:
+            if candidate == value and (candidate.replace(tzinfo=None), candidate.tzinfo) != \
+                    (value.replace(tzinfo=None), value.tzinfo):
+                raise NotSimpleRecurrence('ambiguous occurrence')
+        return value
+
+    def after(self, dt, inc=True):
+        """
+        Returns the first occurrence after dt
+        """
+        if not inc:
+            dt += ONE_MICROSECOND
+        while True:
+            candidates = self._candidates(SimpleRule.after, dt)
+            index = bisect.bisect_left(self.rdates, dt)
+            if index < len(self.rdates):
+                candidates.append(self.rdates[index])
+            value = self._pick(candidates, min)
+            if value is None or value not in self.exdates:
+                return value
+            dt = value + ONE_MICROSECOND
+
+    def before(self, dt, inc=True):
+        """
+        Returns the last occurrence before dt
+        """
+        if not inc:
+            dt -= ONE_MICROSECOND
+        while True:
+            candidates = self._candidates(SimpleRule.before, dt)
+            index = bisect.bisect_right(self.rdates, dt)
+            if index > 0:
+                candidates.append(self.rdates[index - 1])
+            value = self._pick(candidates, max)
+            if value is None or value not in self.exdates:
+                return value
+            dt = value - ONE_MICROSECOND
+
+    def between(self, after, before, inc=True):
+        """
+        Returns a list with the occurrences between after and before
+        """
+        dates = []
+        date = self.after(after, inc)
+        while date is not None and (date < before or inc and date == before):
+            dates.append(date)
+            date = self.after(date, inc=False)
+        return dates
+
+
+class Checkpoints(object):
+    """
+    Periodic anchor occurrences of every rule of a recurrence
+
+    For each checkpoint we store the first occurrence of every rule (and exrule) greater or equal than the checkpoint
+    and how many occurrences were generated before it. A rule restarted at its anchor generates the same occurrences,
+    so queries after a checkpoint don't need to iterate from dtstart.
+    """
+    DT_FORMAT = '%Y-%m-%dT%H:%M:%S'
+
+    def __init__(self, key, checkpoints):
+        self.key = key
+        self.checkpoints = checkpoints
+        self.dates = [_checkpoint[0] for _checkpoint in checkpoints]
+
+    @staticmethod
+    def get_key(_recurrence, start_dt):
+        rules = recurrence.Recurrence(rrules=_recurrence.rrules, exrules=_recurrence.exrules)
+        return hashlib.md5(recurrence.serialize(rules) + start_dt.isoformat()).hexdigest()
+
+    @classmethod
+    def build(cls, _recurrence, start_dt, until_dt, step=CHECKPOINTS_STEP):
+        """
+        Returns the checkpoints between start_dt and until_dt
+        """
+        offset = start_dt.utcoffset()
+        start = start_dt.replace(tzinfo=None)
+        until = _to_naive(until_dt, offset)
+        dates = []
+        date = start + step
+        while date <= until:
+            dates.append(date)
+            date += step
+
+        anchors = [
+            cls._build_anchors(_rule, start_dt, dates)
+            for _rule in list(_recurrence.rrules) + list(_recurrence.exrules)
+        ]
+        checkpoints = [
+            (date.strftime(cls.DT_FORMAT), [_anchors[index] for _anchors in anchors])
+            for index, date in enumerate(dates)
+        ]
+        return cls(cls.get_key(_recurrence, start_dt), checkpoints)
+
+    @classmethod
+    def _build_anchors(cls, rule, start_dt, dates):
+        anchors = []
+        generated = 0
+        for occurrence in rule.to_dateutil_rrule(dtstart=start_dt):
+            if len(anchors) == len(dates):
+                return anchors
+            occurrence = occurrence.replace(tzinfo=None)
+            while len(anchors) < len(dates) and occurrence >= dates[len(anchors)]:
+                anchors.append((occurrence.strftime(cls.DT_FORMAT), generated))
+            generated += 1
+        # The rule was exhausted
+        return anchors + [(None, generated)] * (len(dates) - len(anchors))
+
+    @classmethod
+    def loads(cls, text):
+        if not text:
+            return None
+        data = json.loads(text)
+        return cls(data['key'], data['checkpoints'])
+
+    def dumps(self):
+        return json.dumps({'key': self.key, 'checkpoints': self.checkpoints})
+
+    def rruleset(self, _recurrence, start_dt, dt):
+        """
+        Returns a dateutil rruleset with the same occurrences greater or equal than the nearest checkpoint before dt
+        None if there is no valid checkpoint
+        """
+        if _recurrence.dtend or self.key != self.get_key(_recurrence, start_dt):
+            return None
+        naive_dt = _to_naive(dt, start_dt.utcoffset()).strftime(self.DT_FORMAT)
+        index = bisect.bisect_right(self.dates, naive_dt) - 1
+        if index < 0:
+            return None
+        checkpoint, anchors = self.checkpoints[index]
+        checkpoint_dt = self._aware(checkpoint, start_dt)
+
+        rruleset = dateutil.rrule.rruleset()
+        rules = list(_recurrence.rrules) + list(_recurrence.exrules)
+        for index, (rule, (anchor, generated)) in enumerate(zip(rules, anchors)):
+            if anchor is None:
+                continue
+            rule = copy.copy(rule)
+            if rule.count:
+                rule.count -= generated
+            rrule = rule.to_dateutil_rrule(dtstart=self._aware(anchor, start_dt))
+            if index < len(_recurrence.rrules):
+                rruleset.rrule(rrule)
+            else:
+                rruleset.exrule(rrule)
+        for rdate in _recurrence.rdates:
+            if rdate >= checkpoint_dt:
+                rruleset.rdate(rdate)
+        for exdate in _recurrence.exdates:
+            rruleset.exdate(exdate)
+        return rruleset
+
+    def _aware(self, text, start_dt):
+        return datetime.datetime.strptime(text, self.DT_FORMAT).replace(tzinfo=start_dt.tzinfo)
+
+
+def _rruleset(_recurrence, start_dt, dt, checkpoints=None):
+    """
+    Returns the cheapest rruleset with the same occurrences than the recurrence from dt
+    """
+    try:
+        return SimpleRecurrence(_recurrence, start_dt)
+    except NotSimpleRecurrence:
+        pass
+    if checkpoints:
+        rruleset = checkpoints.rruleset(_recurrence, start_dt, dt)
+        if rruleset is not None:
+            return rruleset
+    return _recurrence.to_dateutil_rruleset(dtstart=start_dt)
+
+
+def rruleset_after(_recurrence, after_dt, start_dt, checkpoints=None):
+    try:
+        return _rruleset(_recurrence, start_dt, after_dt, checkpoints).after(after_dt, True)
+    except NotSimpleRecurrence:
+        return _recurrence.after(after_dt, True, dtstart=start_dt)
+
+
+def rruleset_before(_recurrence, before_dt, start_dt, checkpoints=None):
+    try:
+        dt = _rruleset(_recurrence, start_dt, before_dt, checkpoints).before(before_dt, True)
+    except NotSimpleRecurrence:
+        dt = None
+    if dt is None:
+        # The date could be before the checkpoint
+        return _recurrence.before(before_dt, True, dtstart=start_dt)
+    return dt
+
+
+def rruleset_between(_recurrence, after_dt, before_dt, start_dt, checkpoints=None):
+    try:
+        return _rruleset(_recurrence, start_dt, after_dt, checkpoints).between(after_dt, before_dt, True)
+    except NotSimpleRecurrence:
+        return _recurrence.between(after_dt, before_dt, inc=True, dtstart=start_dt)
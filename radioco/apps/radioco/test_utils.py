@@ -20,7 +20,9 @@ import datetime
 import pytz
 import recurrence
 from django.contrib.auth.models import User
+from django.core.cache import cache
 
+from radioco.apps.radioco import local_cache
 from radioco.apps.programmes.models import Programme, Episode, Podcast, Role
 from radioco.apps.schedules.models import Calendar, Schedule
 
@@ -176,6 +178,12 @@ def create_test_data():
 
 
 class TestDataMixin(object):
+    def _pre_setup(self):
+        # The cache is shared between tests and it isn't rolled back with the database
+        cache.clear()
+        local_cache.clear()
+        super(TestDataMixin, self)._pre_setup()
+
     @classmethod
     def setUpTestData(cls):
         create_test_data()
@@ -15,11 +15,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import datetime
 
+import mock
 import pytz
+from django.core.cache import cache
+from django.core.signals import request_started, request_finished
 from django.core.urlresolvers import reverse
 from django.test import TestCase
+from recurrence import serialize
 
-from radioco.apps.radioco.utils import create_example_data
+from radioco.apps.global_settings.models import SiteConfiguration
+from radioco.apps.programmes.models import Programme, Episode
+from radioco.apps.radioco import local_cache
+from radioco.apps.radioco.utils import create_example_data, update_in_batches
+from radioco.apps.schedules.models import Calendar, Schedule, Transmission
 from radioco.apps.radioco.test_utils import TestDataMixin, SPAIN_TZ
 
 
@@ -43,8 +51,164 @@ class UtilsTest(TestCase):
         self.assertEquals(utc_dict.get(utc_dt), utc_dict.get(utc_dt.astimezone(SPAIN_TZ)))
         self.assertEquals(spain_dict.get(spanish_dt), spain_dict.get(spanish_dt.astimezone(pytz.utc)))
 
+    def test_update_in_batches(self):
+        programme = Programme.objects.create(name='Batches', current_season=1, runtime=60)
+        episodes = [
+            Episode.objects.create_episode(pytz.utc.localize(datetime.datetime(2015, 1, _day, 10, 0, 0)), programme)
+            for _day in range(1, 6)
+        ]
+        for episode in episodes:
+            episode.issue_date += datetime.timedelta(days=1)
+            episode.title = 'Changed'
+        episodes[-1].issue_date = None
+
+        # Two updates inside a savepoint
+        with self.assertNumQueries(4):
+            update_in_batches(Episode, episodes, ['issue_date'], batch_size=3)
+        self.assertListEqual(
+            list(Episode.objects.filter(programme=programme).order_by('id').values_list('issue_date', 'title')),
+            [(_episode.issue_date, None) for _episode in episodes])
+
+
+class DirtyFieldsMixinTests(TestDataMixin, TestCase):
+    def test_changed_fields(self):
+        programme = Programme.objects.get(id=self.programme.id)
+        with self.assertNumQueries(0):
+            self.assertSetEqual(programme.changed_fields, set())
+            programme.start_date = datetime.date(2015, 1, 1)
+            programme.name = 'New name'
+            self.assertSetEqual(programme.changed_fields, {'start_date', 'name'})
+            self.assertIsNone(programme.get_saved_value('start_date'))
+        programme.save()
+        self.assertSetEqual(programme.changed_fields, set())
+
+    def test_new_object(self):
+        programme = Programme(name='New programme', current_season=1, _runtime=60)
+        self.assertFalse(programme.has_snapshot())
+        self.assertIn('name', programme.changed_fields)
+        self.assertIsNone(programme.get_saved_instance())
+
+    def test_mutable_values(self):
+        schedule = Schedule.objects.get(id=self.schedule.id)
+        schedule.recurrences.exdates.append(schedule.start_dt)
+        self.assertSetEqual(schedule.changed_fields, {'recurrences'})
+        self.assertListEqual(schedule.get_saved_instance().recurrences.exdates, [])
+
+    def test_serialized_values(self):
+        schedule = Schedule.objects.get(id=self.schedule.id)
+        saved_recurrences = schedule.get_saved_value('recurrences')
+        self.assertIsNot(saved_recurrences, schedule.recurrences)
+        self.assertEqual(serialize(saved_recurrences), serialize(schedule.recurrences))
+        self.assertIs(schedule.get_saved_value('start_dt'), schedule.start_dt)
+
+    def test_loaded_values_not_serialized(self):
+        field = Schedule._meta.get_field('recurrences')
+        with mock.patch.object(field, 'get_prep_value', wraps=field.get_prep_value) as get_prep_value:
+            schedules = list(Schedule.objects.all())
+        self.assertFalse(get_prep_value.called)
+        for schedule in schedules:
+            self.assertSetEqual(schedule.changed_fields, set())
+        schedules[0].recurrences.exdates.append(schedules[0].start_dt)
+        self.assertSetEqual(schedules[0].changed_fields, {'recurrences'})
+
+    def test_refresh_from_db(self):
+        programme = Programme.objects.get(id=self.programme.id)
+        Programme.objects.filter(id=programme.id).update(name='Updated')
+        programme.refresh_from_db()
+        self.assertEqual(programme.get_saved_value('name'), 'Updated')
+        self.assertSetEqual(programme.changed_fields, set())
+
+    def test_programme_save_without_extra_queries(self):
+        programme = Programme.objects.get(id=self.programme.id)
+        programme.synopsis = 'New synopsis'
+        with self.assertNumQueries(1):
+            programme.save()
+
 
 class RadioIntegrationTests(TestDataMixin, TestCase):
     def test_index(self):
         response = self.client.get(reverse("home"))
         self.assertEqual(response.status_code, 200)
+
+    @mock.patch('radioco.apps.radioco.views.is_cache_shared', lambda: True)
+    def test_index_snapshot(self):
+        self.client.get(reverse("home"))
+        with mock.patch.object(Transmission, 'upcoming') as upcoming:
+            response = self.client.get(reverse("home"))
+        self.assertFalse(upcoming.called)
+        self.assertEqual(response.status_code, 200)
+        self.assertLessEqual(len(response.context['other_programmes']), 10)
+        self.assertEqual(
+            len(set(_programme.id for _programme in response.context['other_programmes'])),
+            len(response.context['other_programmes']))
+
+    @mock.patch('radioco.apps.radioco.views.is_cache_shared', lambda: True)
+    def test_index_snapshot_invalidation(self):
+        self.client.get(reverse("home"))
+        episode = Episode.objects.filter(podcast__isnull=False).order_by('-issue_date').first()
+        episode.podcast.delete()
+        response = self.client.get(reverse("home"))
+        self.assertNotIn(episode, response.context['latest_episodes'])
+
+    def test_index_snapshot_cache_not_shared(self):
+        with mock.patch('radioco.apps.radioco.views.is_cache_shared', lambda: False):
+            self.client.get(reverse("home"))
+            with mock.patch.object(Transmission, 'upcoming', return_value=[]) as upcoming:
+                response = self.client.get(reverse("home"))
+        self.assertTrue(upcoming.called)
+        self.assertEqual(response.status_code, 200)
+
+
+class LocalCacheTests(TestDataMixin, TestCase):
+    def setUp(self):
+        SiteConfiguration.objects.get_or_create(pk=1)
+        # Acting as if the cache were shared between processes
+        patcher = mock.patch.object(local_cache, 'is_cache_shared', return_value=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_get_global(self):
+        site_config = SiteConfiguration.get_global()
+        with self.assertNumQueries(0):
+            another_site_config = SiteConfiguration.get_global()
+        self.assertEqual(another_site_config, site_config)
+
+        # Every caller gets its own instance
+        site_config.site_name = 'Another name'
+        self.assertEqual(SiteConfiguration.get_global().site_name, 'RadioCo')
+
+    def test_changes_from_other_processes(self):
+        SiteConfiguration.get_global()
+        SiteConfiguration.objects.filter(pk=1).update(site_name='Another name')
+        cache.delete('SiteConfiguration')
+        cache.incr(local_cache.VERSION_KEY)
+        self.assertEqual(SiteConfiguration.get_global().site_name, 'Another name')
+
+    def test_version_is_read_once_per_request(self):
+        SiteConfiguration.get_global()
+        Calendar.get_active_id()
+        request_started.send(sender=self.__class__)
+        try:
+            with mock.patch.object(cache, 'get', wraps=cache.get) as cache_get:
+                SiteConfiguration.get_global()
+                SiteConfiguration.get_global()
+                Calendar.get_active_id()
+            self.assertEqual(cache_get.call_count, 1)
+        finally:
+            request_finished.send(sender=self.__class__)
+
+    def test_active_calendar_id(self):
+        self.assertEqual(Calendar.get_active_id(), self.calendar.id)
+        with self.assertNumQueries(0):
+            self.assertEqual(Calendar.get_active_id(), self.calendar.id)
+
+        self.another_calendar.is_active = True
+        self.another_calendar.save()
+        self.assertEqual(Calendar.get_active_id(), self.another_calendar.id)
+
+    def test_cache_not_shared(self):
+        with mock.patch.object(local_cache, 'is_cache_shared', return_value=False):
+            Calendar.get_active_id()
+            Calendar.objects.filter(id=self.calendar.id).update(is_active=False)
+            Calendar.objects.filter(id=self.another_calendar.id).update(is_active=True)
+            self.assertEqual(Calendar.get_active_id(), self.another_calendar.id)
@@ -4,6 +4,7 @@ import pytz
 from dateutil.tz import tzoffset
 from django.utils import timezone
 
+from radioco.apps.radioco.recurrence_utils import rruleset_after, rruleset_before, rruleset_between
 from radioco.apps.radioco.utils import memorize
 
 timestamp = datetime.datetime(2009, 1, 1)  # any unambiguous timestamp will work here
@@ -121,23 +122,30 @@ def _fix_invalid_dt(recurrence, dt):
     return None
 
 
-def recurrence_after(recurrence, after_dt, start_dt):
+def recurrence_after(recurrence, after_dt, start_dt, checkpoints=None):
     """
     Fix for django-recurrence 1.3
     Avoid outputting a impossible dt
     """
-    dt = recurrence.after(after_dt, True, dtstart=start_dt)
+    dt = rruleset_after(recurrence, after_dt, start_dt, checkpoints)
     if dt == start_dt:
         return _fix_invalid_dt(recurrence, dt)
     return dt
 
 
-def recurrence_before(recurrence, before_dt, start_dt):
+def recurrence_before(recurrence, before_dt, start_dt, checkpoints=None):
     """
     Fix for django-recurrence 1.3
     Avoid outputting a impossible dt
     """
-    dt = recurrence.before(before_dt, True, dtstart=start_dt)
+    dt = rruleset_before(recurrence, before_dt, start_dt, checkpoints)
     if dt == start_dt:
         return _fix_invalid_dt(recurrence, dt)
     return dt
+
+
+def recurrence_between(recurrence, after_dt, before_dt, start_dt, checkpoints=None):
+    """
+    Return a list of dates between after_dt and before_dt (both included)
+    """
+    return rruleset_between(recurrence, after_dt, before_dt, start_dt, checkpoints)
@@ -1,6 +1,20 @@
+import datetime
+import time
+from collections import namedtuple
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.db.models import Case, When, Value
 from django.http import HttpResponseForbidden
 from django.views.generic.detail import SingleObjectMixin
 
+# Maximum number of rows updated in a single query
+UPDATE_BATCH_SIZE = getattr(settings, 'UPDATE_BATCH_SIZE', 200)
+
 
 def create_example_data():
     from django.contrib.auth.models import User
@@ -34,6 +48,53 @@ def create_example_data():
     create_test_data()
 
 
+def get_cache_version(key):
+    """
+    Returns a counter stored in the cache, used to notify changes to other processes
+    """
+    version = cache.get(key)
+    if version is None:
+        # Starting from the current time to not reuse old versions if the cache is cleared
+        cache.add(key, int(time.time() * 1000), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        get_cache_version(key)
+
+
+def is_cache_shared():
+    """
+    Returns True if the default cache is shared between processes, otherwise changes made by one process can't be
+    notified to the rest
+    """
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def update_in_batches(model, objects, fields, batch_size=None):
+    """
+    Stores the given fields of the objects in a single transaction, running one UPDATE ... CASE query per batch
+    instead of one query per object. Signals are not sent.
+    """
+    batch_size = batch_size or UPDATE_BATCH_SIZE
+    objects = list(objects)
+    with transaction.atomic():
+        for index in range(0, len(objects), batch_size):
+            batch = objects[index:index + batch_size]
+            updates = {}
+            for field_name in fields:
+                field = model._meta.get_field(field_name)
+                updates[field.attname] = Case(*[
+                    When(pk=_obj.pk, then=Value(getattr(_obj, field.attname), output_field=field))
+                    for _obj in batch
+                ], output_field=field)
+            model._default_manager.filter(pk__in=[_obj.pk for _obj in batch]).update(**updates)
+
+
 class memorize(dict):
     """
     A simple cache system, use as decorator
@@ -49,8 +110,97 @@ class memorize(dict):
         return result
 
 
-def field_has_changed(_object, field):
-    return _object.id and getattr(_object.__class__.objects.get(id=_object.id), field) != getattr(_object, field)
+# Values which can't be modified in place, they are stored in the snapshot as they are
+IMMUTABLE_TYPES = (
+    type(None), bool, int, long, float, Decimal, basestring, datetime.date, datetime.time, datetime.timedelta
+)
+
+SerializedValue = namedtuple('SerializedValue', ['value'])
+
+
+class DirtyFieldsMixin(object):
+    """
+    Model mixin which keeps a snapshot of the values loaded from the database
+    Allows to know which fields have changed without doing queries
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super(DirtyFieldsMixin, cls).from_db(db, field_names, values)
+        instance._take_snapshot(loaded=True)
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super(DirtyFieldsMixin, self).refresh_from_db(*args, **kwargs)
+        self._take_snapshot(loaded=True)
+
+    def save(self, *args, **kwargs):
+        super(DirtyFieldsMixin, self).save(*args, **kwargs)
+        self._take_snapshot()
+
+    def _take_snapshot(self, loaded=False):
+        # Deferred fields are not loaded
+        self._snapshot = {
+            _field.attname: self._get_snapshot_value(_field, loaded)
+            for _field in self._meta.concrete_fields if _field.attname in self.__dict__
+        }
+
+    def _get_snapshot_value(self, field, loaded=False):
+        # Mutable values (e.g. recurrences) are stored serialized, copying them is much slower
+        value = self.__dict__[field.attname]
+        if isinstance(value, IMMUTABLE_TYPES):
+            return value
+        # Values just loaded can keep their database representation (see SnapshotRecurrenceField)
+        db_value = getattr(value, 'db_value', None) if loaded else None
+        if db_value is not None:
+            return SerializedValue(db_value)
+        return SerializedValue(field.get_prep_value(value))
+
+    def has_snapshot(self):
+        """
+        Returns True if the object was loaded from the database (or saved)
+        """
+        snapshot = getattr(self, '_snapshot', None)
+        if not snapshot or self.pk is None:
+            return False
+        return snapshot.get(self._meta.pk.attname) == self.pk
+
+    def get_saved_value(self, field):
+        """
+        Returns the value of a field in the database
+        """
+        return self._get_saved_value(self._meta.get_field(field))
+
+    def _get_saved_value(self, field):
+        value = self._snapshot[field.attname]
+        if isinstance(value, SerializedValue):
+            return field.to_python(value.value)
+        return value
+
+    def get_saved_instance(self):
+        """
+        Returns a new object with the values in the database or None if the object is not in the database
+        """
+        if not self.has_snapshot():
+            return None
+        return self.__class__(**{
+            _field.attname: self._get_saved_value(_field)
+            for _field in self._meta.concrete_fields if _field.attname in self._snapshot
+        })
+
+    @property
+    def changed_fields(self):
+        """
+        Returns the set of fields whose value is different than the one in the database
+        All the fields are changed if the object is not in the database
+        """
+        if not self.has_snapshot():
+            return set(_field.name for _field in self._meta.concrete_fields)
+        return set(
+            _field.name for _field in self._meta.concrete_fields
+            if _field.attname in self._snapshot and _field.attname in self.__dict__ and
+            self._snapshot[_field.attname] != self._get_snapshot_value(_field)
+        )
 
 
 def check_delete_permission(user, model):
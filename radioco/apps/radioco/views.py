@@ -15,28 +15,60 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-import datetime
+import random
 
 from django.contrib.auth import (
     logout,
 )
+from django.core.cache import cache
 from django.db.models import Q
 from django.http import HttpResponseRedirect
 from django.shortcuts import render
 from django.utils import timezone
 
 from radioco.apps.programmes.models import Programme, Episode
+from radioco.apps.radioco.utils import is_cache_shared
 from radioco.apps.schedules.models import Transmission
+from radioco.apps.schedules.utils import get_schedules_version
+
+HOME_SNAPSHOT_TIMEOUT = 60 * 60
+
+
+def get_home_snapshot(now):
+    """
+    Expensive parts of the home page, cached until a transmission starts or ends or the schedules change
+    The snapshot is only cached if the cache is shared, otherwise changes made by other processes can't be detected
+    """
+    version = get_schedules_version() if is_cache_shared() else None
+    key = 'home_snapshot:{version}'.format(version=version)
+    snapshot = cache.get(key) if version is not None else None
+    if snapshot is None:
+        snapshot = {
+            # The live transmission (if any) and the next six
+            'transmissions': list(Transmission.upcoming(now, 7)),
+            'programme_ids': list(Programme.objects.filter(
+                Q(end_date__gte=now) | Q(end_date__isnull=True)).values_list('id', flat=True)),
+            'latest_episodes': list(Episode.objects.filter(
+                podcast__isnull=False).select_related('programme').order_by('-issue_date')[:5]),
+        }
+        timeout = HOME_SNAPSHOT_TIMEOUT
+        next_change = Transmission.next_change(now)
+        if next_change:
+            timeout = min(timeout, int((next_change - now).total_seconds()))
+        if version is not None and timeout > 0:
+            cache.set(key, snapshot, timeout)
+    return snapshot
 
 
 def index(request):
     now = timezone.now()
+    snapshot = get_home_snapshot(now)
 
-    transmissions_between = Transmission.between(now, now + datetime.timedelta(hours=+16))
+    transmissions = iter(snapshot['transmissions'])
     next_transmissions = []
 
     try:
-        live_transmission = transmissions_between.next()
+        live_transmission = transmissions.next()
         if live_transmission.start <= now < live_transmission.end:
             percentage = int(round(
                 (now - live_transmission.start).total_seconds() /
@@ -52,12 +84,15 @@ def index(request):
     try:
         max_num_of_next_transmissions = 6 - len(next_transmissions)
         for num in range(max_num_of_next_transmissions):
-            next_transmissions.append(transmissions_between.next())
+            next_transmissions.append(transmissions.next())
     except StopIteration:
         pass
 
-    other_programmes = Programme.objects.filter(Q(end_date__gte=now) | Q(end_date__isnull=True)).order_by('?').all()[:10]
-    latest_episodes = Episode.objects.filter(podcast__isnull=False).select_related('programme').order_by('-issue_date')[:5]
+    # Sampling the cached ids instead of sorting the table randomly
+    programme_ids = random.sample(snapshot['programme_ids'], min(10, len(snapshot['programme_ids'])))
+    programmes = Programme.objects.in_bulk(programme_ids)
+    other_programmes = [programmes[_id] for _id in programme_ids if _id in programmes]
+    latest_episodes = snapshot['latest_episodes']
 
     context = {
         'now': now, 'percentage': percentage,
@@ -0,0 +1,101 @@
+"""
+Calendar activation job
+
+Activating a calendar rearranges the episodes of every current programme. The job is queued as a CalendarActivation,
+which is only visible to other connections once the transaction that activated the calendar is committed, and it's
+run by the run_calendar_activations command. Programmes are independent, so they are distributed over a pool of
+processes (each one with its own database connection).
+"""
+import multiprocessing
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import F
+from django.utils import timezone
+
+# Number of processes used to rearrange episodes, by default one per core
+CALENDAR_ACTIVATION_PROCESSES = getattr(settings, 'CALENDAR_ACTIVATION_PROCESSES', None)
+
+
+def _rearrange_programme(args):
+    from radioco.apps.programmes.models import Programme
+    from radioco.apps.schedules.models import Calendar
+    programme_id, calendar_id, now = args
+    programme = Programme.objects.get(id=programme_id)
+    return programme.rearrange_episodes(now, Calendar.objects.get(id=calendar_id))
+
+
+def _close_connections():
+    # Connections can't be shared between processes
+    connections.close_all()
+
+
+def _update_progress(activation, done):
+    from radioco.apps.schedules.models import CalendarActivation
+    CalendarActivation.objects.filter(id=activation.id).update(done=F('done') + done)
+
+
+def _finish(activation):
+    from radioco.apps.schedules.models import CalendarActivation
+    CalendarActivation.objects.filter(id=activation.id).update(finished_dt=timezone.now())
+
+
+def run_activation(activation, processes=None, pool_class=multiprocessing.Pool):
+    """
+    Rearrange the episodes of the current programmes from the activation date, updating the progress
+    An interrupted activation can be run again, it starts from scratch
+    """
+    from radioco.apps.schedules.models import CalendarActivation
+    now = activation.started_dt
+    programme_ids = list(activation.calendar.get_current_programmes(now).values_list('id', flat=True))
+    CalendarActivation.objects.filter(id=activation.id).update(done=0, total=len(programme_ids))
+
+    tasks = [(_programme_id, activation.calendar_id, now) for _programme_id in programme_ids]
+    if processes == 1:
+        for task in tasks:
+            _rearrange_programme(task)
+            _update_progress(activation, 1)
+    else:
+        _close_connections()
+        pool = pool_class(processes, initializer=_close_connections)
+        try:
+            for _ in pool.imap_unordered(_rearrange_programme, tasks):
+                _update_progress(activation, 1)
+        finally:
+            pool.close()
+            pool.join()
+    _finish(activation)
+
+
+def run_pending_activations(processes=CALENDAR_ACTIVATION_PROCESSES, pool_class=multiprocessing.Pool):
+    """
+    Runs the unfinished activations of the active calendar, older ones and the ones of other calendars are
+    superseded and only marked as finished
+
+    Returns: the number of activations run
+    """
+    from radioco.apps.schedules.models import CalendarActivation
+    pending = CalendarActivation.objects.filter(
+        finished_dt__isnull=True
+    ).select_related('calendar').order_by('-started_dt', '-id')
+
+    run = 0
+    for activation in pending:
+        if run or not activation.calendar.is_active:
+            _finish(activation)
+        else:
+            run_activation(activation, processes, pool_class)
+            run += 1
+    return run
+
+
+def start_activation(calendar):
+    """
+    Queues the rearrangement of the episodes of a calendar which has been activated
+
+    Returns: the CalendarActivation which tracks the progress
+    """
+    from radioco.apps.schedules.models import CalendarActivation
+    return CalendarActivation.objects.create(
+        calendar=calendar, total=calendar.get_current_programmes(timezone.now()).count()
+    )
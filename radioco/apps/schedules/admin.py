@@ -19,10 +19,11 @@ import copy
 
 from django.contrib import admin
 from django.core.checks import messages
+from django.db.models import Prefetch
 from django.utils.translation import ugettext_lazy as _
 
 from radioco.apps.global_settings.models import CalendarConfiguration
-from radioco.apps.schedules.models import Schedule, Calendar
+from radioco.apps.schedules.models import Schedule, Calendar, CalendarActivation
 
 try:
     from django.utils.encoding import force_unicode
@@ -32,7 +33,7 @@ except ImportError:
 
 @admin.register(Calendar)
 class CalendarAdmin(admin.ModelAdmin):
-    list_display = ('name', 'is_active')
+    list_display = ('name', 'is_active', 'activation_status')
     list_filter = ['is_active']
     search_fields = ['name']
     ordering = ['name']
@@ -48,6 +49,17 @@ class CalendarAdmin(admin.ModelAdmin):
             self.message_user(request, _('You cannot mark more than 1 schedule as active'), level=messages.ERROR)
     set_active.short_description = _("Set a calendar active")
 
+    def get_queryset(self, request):
+        queryset = super(CalendarAdmin, self).get_queryset(request)
+        return queryset.prefetch_related(Prefetch(
+            'calendaractivation_set', queryset=CalendarActivation.objects.order_by('-started_dt', '-id')
+        ))
+
+    def activation_status(self, obj):
+        activations = obj.calendaractivation_set.all()
+        return unicode(activations[0]) if activations else ''
+    activation_status.short_description = _('activation')
+
     def clone_calendar(self, request, queryset):
         for obj in queryset:
             obj_copy = copy.copy(obj)
@@ -0,0 +1,217 @@
+"""
+Batch expansion of schedules using numpy
+
+Schedules with a recurrence that can be evaluated in closed form (see recurrence_utils.SimpleRecurrence) are expanded
+all at once into columnar arrays of dates and schedule indexes, instead of generating every date one by one.
+numpy is an optional dependency, if it isn't installed `is_available` returns False.
+"""
+import calendar
+import datetime
+from itertools import izip
+
+import pytz
+from django.utils import timezone
+
+from radioco.apps.radioco.recurrence_utils import SimpleRecurrence, NotSimpleRecurrence, _to_naive
+from radioco.apps.radioco.tz_utils import transform_dt_to_default_tz
+from radioco.apps.radioco.utils import memorize
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+EPOCH = datetime.datetime(1970, 1, 1)
+ONE_DAY = 24 * 60 * 60
+SIX_HOURS = 6 * 60 * 60
+
+
+def is_available():
+    return numpy is not None
+
+
+def _seconds(delta):
+    return delta.days * ONE_DAY + delta.seconds
+
+
+def _timestamp(dt):
+    return calendar.timegm(dt.utctimetuple())
+
+
+def _get_simple_recurrence(schedule):
+    """
+    Returns the closed-form recurrence of a schedule or None if the schedule can't be expanded in batch
+    """
+    if not schedule.recurrences.rrules or schedule.recurrences.rdates:
+        return None
+    try:
+        return SimpleRecurrence(schedule.recurrences, transform_dt_to_default_tz(schedule.start_dt))
+    except NotSimpleRecurrence:
+        return None
+
+
+def split_schedules(schedules):
+    """
+    Returns a tuple with the list of schedules which can be expanded in batch and the list of the rest
+    """
+    batchable, others = [], []
+    for schedule in schedules:
+        if _get_simple_recurrence(schedule):
+            batchable.append(schedule)
+        else:
+            others.append(schedule)
+    return batchable, others
+
+
+@memorize
+def _get_transitions(tz):
+    transitions = numpy.array(
+        [_seconds(_dt - EPOCH) for _dt in tz._utc_transition_times], dtype=numpy.int64)
+    offsets = numpy.array([_seconds(_info[0]) for _info in tz._transition_info], dtype=numpy.int64)
+    dsts = numpy.array([bool(_info[1]) for _info in tz._transition_info], dtype=bool)
+    return transitions, offsets, dsts
+
+
+def _localize_offsets(tz, naive):
+    """
+    Vectorized version of `tz.localize(dt).utcoffset()` for naive timestamps
+
+    Ambiguous and non-existent times are resolved in the same way that pytz does using is_dst=False
+    """
+    if not getattr(tz, '_utc_transition_times', None):
+        return numpy.full(len(naive), _seconds(tz.utcoffset(EPOCH)), dtype=numpy.int64)
+    transitions, offsets, dsts = _get_transitions(tz)
+
+    def transition_at(timestamps):
+        return numpy.maximum(numpy.searchsorted(transitions, timestamps, side='right') - 1, 0)
+
+    # Candidates are the offsets one day before and after, they are valid if the wall clock doesn't change
+    candidate_a = offsets[transition_at(naive - ONE_DAY)]
+    candidate_b = offsets[transition_at(naive + ONE_DAY)]
+    transition_a = transition_at(naive - candidate_a)
+    transition_b = transition_at(naive - candidate_b)
+    valid_a = offsets[transition_a] == candidate_a
+    valid_b = (offsets[transition_b] == candidate_b) & (candidate_b != candidate_a)
+
+    result = numpy.where(valid_a, candidate_a, candidate_b)
+
+    # Ambiguous times: choosing the candidate without DST, the latest one otherwise
+    ambiguous = valid_a & valid_b
+    dst_a = dsts[transition_a]
+    dst_b = dsts[transition_b]
+    result = numpy.where(ambiguous & dst_a & ~dst_b, candidate_b, result)
+    result = numpy.where(ambiguous & (dst_a == dst_b), numpy.minimum(candidate_a, candidate_b), result)
+
+    # Non-existent times: using the offset of six hours before
+    missing = ~valid_a & ~valid_b
+    if missing.any():
+        result[missing] = _localize_offsets(tz, naive[missing] - SIX_HOURS)
+    return result
+
+
+class TransmissionArray(object):
+    """
+    Columnar representation of transmissions sorted by date
+
+    starts is an array of datetime64 in UTC and schedule_indexes the position of the schedule of every transmission
+    """
+
+    def __init__(self, schedules, starts, schedule_indexes):
+        self.schedules = schedules
+        self.starts = starts
+        self.schedule_indexes = schedule_indexes
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        """
+        Yields tuples of date (in the default timezone) and schedule, as Schedule.dates_between does
+        """
+        timestamps = self.starts.astype(numpy.int64).tolist()
+        for timestamp, index in izip(timestamps, self.schedule_indexes.tolist()):
+            date = pytz.utc.localize(EPOCH + datetime.timedelta(seconds=timestamp))
+            yield transform_dt_to_default_tz(date), self.schedules[index]
+
+
+def expand(schedules, after, before):
+    """
+    Expands all the schedules at once, same as merging the result of `dates_between` of every schedule
+
+    Schedules have to be batchable (see split_schedules)
+    """
+    tz = timezone.get_default_timezone()
+
+    # One row per rule
+    rule_indexes, bases, periods, sizes, days, times, offsets, firsts, lasts = [], [], [], [], [], [], [], [], []
+    # Dates which don't come from rules
+    extra_naive, extra_indexes = [], []
+    started_starts, started_indexes = [], []
+    excluded = []
+
+    for index, schedule in enumerate(schedules):
+        after_date = schedule._merge_after(after)
+        if not after_date:
+            continue
+        after_date = transform_dt_to_default_tz(after_date)
+        before_date = transform_dt_to_default_tz(schedule._merge_before(before))
+        simple = _get_simple_recurrence(schedule)
+
+        for rule in simple.rules:
+            first, last = rule.positions_between(
+                _to_naive(after_date, rule.offset), _to_naive(before_date, rule.offset))
+            rule_indexes.append(index)
+            bases.append((rule.base - EPOCH.date()).days)
+            periods.append(rule.period)
+            sizes.append(len(rule.days))
+            days.append(rule.days + [0] * (7 - len(rule.days)))
+            times.append(_seconds(datetime.datetime.combine(EPOCH.date(), rule.time) - EPOCH))
+            offsets.append(_seconds(rule.offset))
+            firsts.append(first)
+            lasts.append(last)
+
+        for rdate in simple.rdates:
+            if after_date <= rdate <= before_date:
+                extra_naive.append(_timestamp(rdate) + _seconds(rdate.utcoffset()))
+                extra_indexes.append(index)
+        excluded.extend((_timestamp(_exdate), index) for _exdate in simple.exdates)
+
+        # Special case to include started episodes
+        date_before = schedule.date_before(after_date)
+        if date_before and date_before < after_date < date_before + schedule.runtime:
+            started_starts.append(_timestamp(date_before))
+            started_indexes.append(index)
+
+    int_array = lambda values: numpy.array(values, dtype=numpy.int64)
+    rule_indexes, offsets = int_array(rule_indexes), int_array(offsets)
+    firsts, lasts = int_array(firsts), int_array(lasts)
+
+    # Generating the positions of every rule
+    counts = numpy.maximum(lasts - firsts + 1, 0)
+    rows = numpy.repeat(numpy.arange(len(counts)), counts)
+    positions = firsts[rows] + numpy.arange(counts.sum()) - (numpy.cumsum(counts) - counts)[rows]
+    sizes = int_array(sizes)[rows]
+    dates = int_array(bases)[rows] + positions // sizes * int_array(periods)[rows] + \
+        int_array(days).reshape(-1, 7)[rows, positions % sizes]
+    naive = dates * ONE_DAY + int_array(times)[rows]
+
+    # All the dates of a schedule have the offset of its start date
+    schedule_offsets = numpy.zeros(len(schedules), dtype=numpy.int64)
+    schedule_offsets[rule_indexes] = offsets
+    indexes = numpy.concatenate([rule_indexes[rows], int_array(extra_indexes)])
+    instants = numpy.concatenate([naive, int_array(extra_naive)]) - schedule_offsets[indexes]
+
+    # Removing duplicates and excluded dates
+    keys = numpy.unique(instants * max(len(schedules), 1) + indexes)
+    if excluded:
+        excluded_keys = int_array([_instant * len(schedules) + _index for _instant, _index in excluded])
+        keys = keys[~numpy.in1d(keys, excluded_keys)]
+    instants, indexes = numpy.divmod(keys, max(len(schedules), 1))
+
+    # Fixing DST, the wall clock is the same but the offset has to be the one of the date
+    naive = instants + schedule_offsets[indexes]
+    starts = numpy.concatenate([naive - _localize_offsets(tz, naive), int_array(started_starts)])
+    indexes = numpy.concatenate([indexes, int_array(started_indexes)])
+
+    order = numpy.argsort(starts, kind='mergesort')
+    return TransmissionArray(schedules, starts[order].astype('datetime64[s]'), indexes[order])
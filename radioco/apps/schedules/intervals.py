@@ -0,0 +1,105 @@
+"""
+In-memory index of the transmissions of the active calendar
+
+Every process keeps an index with the transmissions of the next TRANSMISSION_INDEX_HOURS hours, so finding what is on
+air doesn't need to query the database. The index is rebuilt lazily when the schedules version changes (see
+utils.bump_schedules_version) or when the requested date is not covered anymore. It's disabled by default, changes
+are only notified to other processes if the cache is shared between them (e.g. memcached).
+"""
+import datetime
+import threading
+from bisect import bisect_right
+
+from django.conf import settings
+from django.utils import timezone
+
+from radioco.apps.schedules.utils import get_schedules_version
+
+TRANSMISSION_INDEX_HOURS = getattr(settings, 'TRANSMISSION_INDEX_HOURS', 0)
+# Dates slightly in the past are still served by the index
+TRANSMISSION_INDEX_PAST = datetime.timedelta(minutes=1)
+
+_lock = threading.Lock()
+_index = None
+
+
+class TransmissionIndex(object):
+    """
+    Transmissions sorted by start, the ones at a given date are found with a binary search
+    Only transmissions starting less than the longest runtime ago can be on air, so the search is bounded
+    """
+
+    def __init__(self, transmissions, after, before, version):
+        self.transmissions = sorted(transmissions, key=lambda _transmission: _transmission.start)
+        self.starts = [_transmission.start for _transmission in self.transmissions]
+        self.ends = [_transmission.end for _transmission in self.transmissions]
+        self.max_runtime = max(
+            [_end - _start for _start, _end in zip(self.starts, self.ends)] or [datetime.timedelta()]
+        )
+        self.after = after
+        self.before = before
+        self.version = version
+
+    def covers(self, at):
+        return self.after <= at < self.before
+
+    def at(self, at):
+        """
+        Returns the list of transmissions on air at the given date sorted by start
+        """
+        transmissions = []
+        min_start = at - self.max_runtime
+        index = bisect_right(self.starts, at) - 1
+        while index >= 0 and self.starts[index] > min_start:
+            if at < self.ends[index]:
+                transmissions.append(self.transmissions[index])
+            index -= 1
+        transmissions.reverse()
+        return transmissions
+
+    def next_change(self, at):
+        """
+        Returns the next date when a transmission starts or ends, None if it isn't covered by the index
+        """
+        dates = [_transmission.end for _transmission in self.at(at)]
+        index = bisect_right(self.starts, at)
+        if index < len(self.starts):
+            dates.append(self.starts[index])
+        if not dates or min(dates) >= self.before:
+            return None
+        return min(dates)
+
+
+def build_index(now, version):
+    from radioco.apps.schedules.models import Transmission
+    after = now - TRANSMISSION_INDEX_PAST
+    before = now + datetime.timedelta(hours=TRANSMISSION_INDEX_HOURS)
+    return TransmissionIndex(Transmission.between(after, before), after, before, version)
+
+
+def get_index(at):
+    """
+    Returns the index of this process covering the given date, rebuilding it if it's outdated
+    None is returned if the index is disabled or the date is too far from now
+    """
+    global _index
+    if not TRANSMISSION_INDEX_HOURS:
+        return None
+    version = get_schedules_version()
+    if version is None:
+        # The cache is not available, changes can't be detected
+        return None
+
+    index = _index
+    if index and index.version == version and index.covers(at):
+        return index
+
+    now = timezone.now()
+    if not now - TRANSMISSION_INDEX_PAST <= at < now + datetime.timedelta(hours=TRANSMISSION_INDEX_HOURS):
+        return None
+    with _lock:
+        index = _index
+        if not index or index.version != version or not index.covers(at):
+            index = build_index(now, version)
+            _index = index
+    return index
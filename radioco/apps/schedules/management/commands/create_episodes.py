@@ -0,0 +1,46 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from radioco.apps.schedules.models import Calendar, Schedule, Transmission
+
+EPISODES_PRECREATION_DAYS = getattr(settings, 'EPISODES_PRECREATION_DAYS', 7)
+
+
+class Command(BaseCommand):
+    help = (
+        'Create the missing episodes of the next live transmissions of the active calendar, so the recorder '
+        'doesn\'t have to create them. Run it periodically (e.g. hourly) or use --every.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=EPISODES_PRECREATION_DAYS, help='Number of days to create episodes for'
+        )
+        parser.add_argument(
+            '--every', type=int, default=None, metavar='MINUTES', help='Keep running, repeating every MINUTES'
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            self.create_episodes(options['days'])
+            if not options['every']:
+                break
+            time.sleep(options['every'] * 60)
+
+    def create_episodes(self, days):
+        calendar_id = Calendar.get_active_id()
+        if not calendar_id:
+            self.stdout.write('There is no active calendar, skipping...')
+            return
+        now = timezone.now()
+        transmissions = list(Transmission.between(
+            now, now + datetime.timedelta(days=days),
+            schedules=Schedule.objects.filter(calendar_id=calendar_id, type='L')
+        ))
+        created = Transmission.create_missing_episodes(transmissions)
+        self.stdout.write('{created} episodes created for {total} transmissions'.format(
+            created=created, total=len(transmissions)))
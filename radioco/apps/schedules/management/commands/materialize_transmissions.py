@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from radioco.apps.schedules.models import Calendar
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the materialized transmissions of the active calendar. Run it periodically (e.g. daily).'
+
+    def handle(self, *args, **options):
+        calendar = Calendar.get_active()
+        if not calendar:
+            self.stdout.write('There is no active calendar, skipping...')
+        else:
+            calendar.materialize_occurrences()
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from radioco.apps.schedules.activation import run_pending_activations
+
+
+class Command(BaseCommand):
+    help = (
+        'Rearrange the episodes after activating a calendar. Run it periodically (e.g. every minute) or use --every.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=None, help='Number of processes, CALENDAR_ACTIVATION_PROCESSES by default'
+        )
+        parser.add_argument(
+            '--every', type=int, default=None, metavar='MINUTES', help='Keep running, repeating every MINUTES'
+        )
+
+    def handle(self, *args, **options):
+        kwargs = {'processes': options['processes']} if options['processes'] else {}
+        while True:
+            run = run_pending_activations(**kwargs)
+            self.stdout.write('{run} calendar activations run'.format(run=run))
+            if not options['every']:
+                break
+            time.sleep(options['every'] * 60)
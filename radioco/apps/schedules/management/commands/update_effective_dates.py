@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from radioco.apps.schedules.models import Schedule, update_effective_dates
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the effective start and end dates of every schedule.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size', type=int, default=500, help='Number of schedules processed at once.')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        schedules = Schedule.objects.select_related('programme').order_by('id')
+        last_id = 0
+        updated = 0
+        while True:
+            chunk = list(schedules.filter(id__gt=last_id)[:chunk_size])
+            if not chunk:
+                break
+            updated += len(update_effective_dates(chunk))
+            last_id = chunk[-1].id
+        self.stdout.write('%s schedules updated' % updated)
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('programmes', '0011__v3_2__ensure_one_user_role'),
+        ('schedules', '0005__v3_0__migrating_schedules_to_unique_calendar'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransmissionOccurrence',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('start', models.DateTimeField(db_index=True)),
+                ('end', models.DateTimeField(db_index=True)),
+                ('type', models.CharField(max_length=1, choices=[(b'L', 'live'), (b'B', 'broadcast'), (b'S', 'broadcast syndication')])),
+                ('programme', models.ForeignKey(to='programmes.Programme')),
+                ('schedule', models.ForeignKey(to='schedules.Schedule')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='calendar',
+            name='occurrences_after',
+            field=models.DateTimeField(help_text='This field is dynamically generated to improve performance', null=True, editable=False, blank=True),
+        ),
+        migrations.AddField(
+            model_name='calendar',
+            name='occurrences_before',
+            field=models.DateTimeField(help_text='This field is dynamically generated to improve performance', null=True, editable=False, blank=True),
+        ),
+    ]
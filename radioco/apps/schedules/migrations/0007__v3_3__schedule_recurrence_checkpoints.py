@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedules', '0006__v3_3__transmission_occurrences'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schedule',
+            name='recurrence_checkpoints',
+            field=models.TextField(default=b'', help_text='This field is dynamically generated to improve performance', editable=False, blank=True),
+        ),
+    ]
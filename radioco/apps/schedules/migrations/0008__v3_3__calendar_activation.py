@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('schedules', '0007__v3_3__schedule_recurrence_checkpoints'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CalendarActivation',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('started_dt', models.DateTimeField(auto_now_add=True, verbose_name='started')),
+                ('finished_dt', models.DateTimeField(null=True, verbose_name='finished', blank=True)),
+                ('total', models.PositiveIntegerField(default=0, verbose_name='programmes')),
+                ('done', models.PositiveIntegerField(default=0, verbose_name='programmes rearranged')),
+                ('calendar', models.ForeignKey(verbose_name='calendar', to='schedules.Calendar')),
+            ],
+            options={
+                'get_latest_by': 'started_dt',
+                'verbose_name': 'calendar activation',
+                'verbose_name_plural': 'calendar activations',
+            },
+        ),
+    ]
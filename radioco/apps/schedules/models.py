@@ -15,19 +15,28 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import datetime
 import heapq
+from collections import namedtuple
 from functools import partial
-from itertools import imap
+from itertools import imap, islice, chain
 
+from django.conf import settings
 from django.core.urlresolvers import reverse
-from django.db import models
-from django.db.models import Q
+from django.db import models, transaction
+from django.db.models import Q, F
+from django.db.models.signals import post_save, post_delete
 from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
+from recurrence import Recurrence, serialize
 from recurrence.fields import RecurrenceField
 
-from radioco.apps.programmes.models import Programme, Episode
+from radioco.apps.programmes.models import Programme, Episode, Podcast
+from radioco.apps.radioco import local_cache
+from radioco.apps.radioco.recurrence_utils import rruleset_before, Checkpoints, SimpleRecurrence, NotSimpleRecurrence
 from radioco.apps.radioco.tz_utils import transform_datetime_tz, fix_recurrence_dst, transform_dt_to_default_tz, \
-    fix_recurrence_date, recurrence_after, recurrence_before
+    fix_recurrence_date, recurrence_after, recurrence_before, recurrence_between
+from radioco.apps.radioco.utils import DirtyFieldsMixin, update_in_batches
+from radioco.apps.schedules import batch, intervals
+from radioco.apps.schedules.utils import rearrange_episodes, bump_schedules_version
 
 EMISSION_TYPE = (
     ("L", _("live")),
@@ -43,6 +52,31 @@ FR = 4
 SA = 5
 SU = 6
 
+# Rolling horizon covered by the materialized occurrences of the active calendar
+OCCURRENCES_HORIZON_PAST = datetime.timedelta(days=getattr(settings, 'OCCURRENCES_HORIZON_PAST_DAYS', 7))
+OCCURRENCES_HORIZON = datetime.timedelta(days=getattr(settings, 'OCCURRENCES_HORIZON_DAYS', 60))
+# How far in the future recurrence checkpoints are generated
+CHECKPOINTS_HORIZON = datetime.timedelta(days=getattr(settings, 'RECURRENCE_CHECKPOINTS_HORIZON_DAYS', 730))
+# Number of transmissions whose episodes are fetched at once
+EPISODES_BATCH_SIZE = 500
+# First and last windows used to calculate upcoming dates
+UPCOMING_WINDOW = datetime.timedelta(days=1)
+UPCOMING_MAX_WINDOW = datetime.timedelta(days=100 * 365)
+
+
+
+class OccurrencesHorizon(namedtuple('OccurrencesHorizon', ['calendar_id', 'after', 'before'])):
+    """
+    Period of time covered by the occurrence table of the active calendar
+    """
+    __slots__ = ()
+
+    def covers(self, after, before):
+        if not self.after or not self.before:
+            return False
+        return self.after <= after and before <= self.before
+
+
 WEEKDAY_CHOICES = (
     (MO, _('Monday')),
     (TU, _('Tuesday')),
@@ -68,17 +102,82 @@ class Calendar(models.Model):
     name = models.CharField(max_length=255, unique=True, verbose_name=_("name"))
     is_active = models.BooleanField(default=False)
 
+    occurrences_after = models.DateTimeField(
+        blank=True, null=True, editable=False,
+        help_text=_('This field is dynamically generated to improve performance')
+    )
+    occurrences_before = models.DateTimeField(
+        blank=True, null=True, editable=False,
+        help_text=_('This field is dynamically generated to improve performance')
+    )
+
     def save(self, *args, **kwargs):
         if self.is_active:
             active_calendars = Calendar.objects.filter(is_active=True)
-            active_calendars.update(is_active=False)
-            self.rearrange_episodes()
+            active_calendars.update(is_active=False, occurrences_after=None, occurrences_before=None)
         super(Calendar, self).save(*args, **kwargs)
+        if self.is_active:
+            self.materialize_occurrences()
+            self.rearrange_episodes()
 
     def rearrange_episodes(self):
-        now = timezone.now()
-        for programme in Programme.objects.filter(Q(end_date__gte=now) | Q(end_date__isnull=True)):
-            programme.rearrange_episodes(now, self)
+        """
+        Rearrange the episodes of the current programmes, the job is run by the run_calendar_activations command
+
+        Returns: the CalendarActivation which tracks the progress
+        """
+        from radioco.apps.schedules.activation import start_activation
+        return start_activation(self)
+
+    def get_current_programmes(self, now):
+        return Programme.objects.filter(Q(end_date__gte=now) | Q(end_date__isnull=True))
+
+    def materialize_occurrences(self, now=None):
+        """
+        Regenerate the occurrence table for the rolling horizon around now
+        """
+        if not now:
+            now = timezone.now()
+        self.occurrences_after = now - OCCURRENCES_HORIZON_PAST
+        self.occurrences_before = now + OCCURRENCES_HORIZON
+        occurrences = []
+        for schedule in self.schedule_set.select_related('programme'):
+            occurrences.extend(schedule._build_occurrences(self.occurrences_after, self.occurrences_before))
+        # Readers see either the old or the new occurrences, never an empty table
+        with transaction.atomic():
+            TransmissionOccurrence.objects.all().delete()
+            TransmissionOccurrence.objects.bulk_create(occurrences)
+            Calendar.objects.filter(pk=self.pk).update(
+                occurrences_after=self.occurrences_after, occurrences_before=self.occurrences_before
+            )
+        # Signals are not sent by update
+        local_cache.invalidate()
+        bump_schedules_version()
+
+    def has_occurrences_between(self, after, before):
+        """
+        Return True if the occurrence table covers the given period of time
+        """
+        return OccurrencesHorizon(self.id, self.occurrences_after, self.occurrences_before).covers(after, before)
+
+    @classmethod
+    def get_active_id(cls):
+        """
+        Returns the id of the active calendar, kept in memory until a calendar changes
+        """
+        active = cls.get_active_horizon()
+        return active.calendar_id if active else None
+
+    @classmethod
+    def get_active_horizon(cls):
+        """
+        Returns the OccurrencesHorizon of the active calendar or None, kept in memory until a calendar changes
+        """
+        def load():
+            values = cls.objects.filter(is_active=True).values_list(
+                'id', 'occurrences_after', 'occurrences_before').first()
+            return OccurrencesHorizon(*values) if values else None
+        return local_cache.get('active_calendar_horizon', load)
 
     @classmethod
     def get_active(cls):
@@ -93,6 +192,31 @@ class Calendar(models.Model):
 # We are not rearranging episodes during deletion
 
 
+class CalendarActivation(models.Model):
+    """
+    Progress of the episode rearrangement after activating a calendar
+    """
+    class Meta:
+        verbose_name = _('calendar activation')
+        verbose_name_plural = _('calendar activations')
+        get_latest_by = 'started_dt'
+
+    calendar = models.ForeignKey(Calendar, verbose_name=_("calendar"))
+    started_dt = models.DateTimeField(auto_now_add=True, verbose_name=_('started'))
+    finished_dt = models.DateTimeField(blank=True, null=True, verbose_name=_('finished'))
+    total = models.PositiveIntegerField(default=0, verbose_name=_('programmes'))
+    done = models.PositiveIntegerField(default=0, verbose_name=_('programmes rearranged'))
+
+    @property
+    def is_finished(self):
+        return self.finished_dt is not None
+
+    def __unicode__(self):
+        if self.is_finished:
+            return unicode(_('Activation finished'))
+        return _('Activating: %(done)s of %(total)s programmes') % {'done': self.done, 'total': self.total}
+
+
 class ExcludedDates(models.Model):
     """
     Helper to improve performance
@@ -114,7 +238,24 @@ class ExcludedDates(models.Model):
         return default_tz.localize(datetime.datetime.combine(self.date, new_dt_in_default_tz.time()))
 
 
-class Schedule(models.Model):
+class SnapshotRecurrenceField(RecurrenceField):
+    """
+    RecurrenceField which remembers the value loaded from the database
+    DirtyFieldsMixin takes it as the snapshot, recurrences don't need to be serialized every time a schedule is loaded
+    """
+    def from_db_value(self, value, *args, **kwargs):
+        recurrences = super(SnapshotRecurrenceField, self).from_db_value(value, *args, **kwargs)
+        if recurrences is not None:
+            recurrences.db_value = value
+        return recurrences
+
+    def deconstruct(self):
+        # Stored as a plain RecurrenceField, migrations don't change
+        name, path, args, kwargs = super(SnapshotRecurrenceField, self).deconstruct()
+        return name, 'recurrence.fields.RecurrenceField', args, kwargs
+
+
+class Schedule(DirtyFieldsMixin, models.Model):
     class Meta:
         verbose_name = _('schedule')
         verbose_name_plural = _('schedules')
@@ -122,7 +263,7 @@ class Schedule(models.Model):
     programme = models.ForeignKey(Programme, verbose_name=_("programme"))
     type = models.CharField(verbose_name=_("type"), choices=EMISSION_TYPE, max_length=1)
     calendar = models.ForeignKey(Calendar, verbose_name=_("calendar"))
-    recurrences = RecurrenceField(
+    recurrences = SnapshotRecurrenceField(
         verbose_name=_("recurrences"),
         help_text=_("Excluded dates will appear in this list as result of dragging and dropping.")
     )
@@ -149,6 +290,11 @@ class Schedule(models.Model):
         help_text=_("Main schedule when (if this is a broadcast).")
     )
 
+    recurrence_checkpoints = models.TextField(
+        blank=True, default='', editable=False,
+        help_text=_('This field is dynamically generated to improve performance')
+    )
+
     def save(self, *args, **kwargs):
         assert self.start_dt, 'start_dt is required'
         self._update_recurrence_dates()
@@ -158,9 +304,59 @@ class Schedule(models.Model):
 
         self._update_effective_dates()
 
+        self._update_recurrence_checkpoints()
+
+        previous = self._get_previous()
+
         super(Schedule, self).save(*args, **kwargs)
 
-        self.programme.rearrange_episodes(timezone.now(), Calendar.get_active())
+        calendar = Calendar.get_active()
+        rearrange_dt = self._get_rearrange_dt(previous, calendar)
+        if rearrange_dt:
+            rearrange_episodes(self.programme, max(timezone.now(), rearrange_dt), calendar)
+        self._update_occurrences()
+
+    def _get_previous(self):
+        """
+        Returns the schedule as it is stored in the database
+        """
+        if not self.pk:
+            return None
+        if self.has_snapshot():
+            return self.get_saved_instance()
+        return Schedule.objects.filter(pk=self.pk).first()
+
+    def _get_rearrange_dt(self, previous, calendar):
+        """
+        Returns the first date whose transmissions could have changed or None if the active calendar is not affected
+        Episodes before that date don't need to be rearranged
+        """
+        if not calendar or calendar.id not in (self.calendar_id, previous and previous.calendar_id):
+            return None
+        if not previous or self._get_rules_state() != previous._get_rules_state():
+            first_dates = filter(None, [self.effective_start_dt, previous and previous.effective_start_dt])
+            return min(first_dates) if first_dates else None
+
+        # Only some dates were excluded or included
+        changed_dates = set(self.recurrences.exdates).symmetric_difference(previous.recurrences.exdates)
+        changed_dates.update(set(self.recurrences.rdates).symmetric_difference(previous.recurrences.rdates))
+        if self.effective_end_dt != previous.effective_end_dt:
+            changed_dates.update(
+                _dt - self.runtime for _dt in filter(None, [self.effective_end_dt, previous.effective_end_dt]))
+        if not changed_dates:
+            # Nothing has changed, rearranging all the episodes anyway
+            return timezone.now()
+        # Excluded dates don't have the DST fixed
+        return min(changed_dates) - datetime.timedelta(days=1)
+
+    def _get_rules_state(self):
+        """
+        Values which affect every date of the schedule
+        """
+        return (
+            self.programme_id, self.type, self.calendar_id, self.start_dt, self.effective_start_dt,
+            serialize(Recurrence(rrules=self.recurrences.rrules, exrules=self.recurrences.exrules))
+        )
 
     def _update_recurrence_dates(self):
         """
@@ -177,20 +373,105 @@ class Schedule(models.Model):
     def _update_excluded_dates(self):
         """
         We need to update dates inside ExcludedDates and the recurrence library
+        ExcludedDates only change if the time of start_dt has changed, exdates are rebuilt from them if the
+        recurrences or the UTC offset of start_dt have been modified
         """
-        exdates = []
-        for excluded in ExcludedDates.objects.filter(schedule=self):
-            new_excluded_dt = excluded.get_new_excluded_datetime(self.start_dt)
-            excluded.datetime = new_excluded_dt
-            excluded.save()
-            exdates.append(fix_recurrence_date(self.start_dt, new_excluded_dt))
-        self.recurrences.exdates = exdates
+        if not self.pk:
+            self.recurrences.exdates = []
+            return
+
+        start_time_has_changed = self._start_time_has_changed()
+        if not start_time_has_changed and not self._start_offset_has_changed() and \
+                'recurrences' not in self.changed_fields:
+            return
+
+        excluded_dates = ExcludedDates.objects.filter(schedule=self)
+        if not start_time_has_changed:
+            self.recurrences.exdates = [
+                fix_recurrence_date(self.start_dt, _dt) for _dt in excluded_dates.values_list('datetime', flat=True)
+            ]
+            return
+
+        excluded_dates = list(excluded_dates)
+        for excluded in excluded_dates:
+            excluded.datetime = excluded.get_new_excluded_datetime(self.start_dt)
+        update_in_batches(ExcludedDates, excluded_dates, ['datetime'])
+        self.recurrences.exdates = [
+            fix_recurrence_date(self.start_dt, _excluded.datetime) for _excluded in excluded_dates
+        ]
+
+    def _start_time_has_changed(self):
+        if not self.has_snapshot():
+            return True
+        saved_start_dt = self.get_saved_value('start_dt')
+        return saved_start_dt is None or \
+            transform_dt_to_default_tz(saved_start_dt).time() != transform_dt_to_default_tz(self.start_dt).time()
+
+    def _start_offset_has_changed(self):
+        # Exdates have the offset of start_dt, it changes when start_dt moves across DST
+        if not self.has_snapshot():
+            return True
+        saved_start_dt = self.get_saved_value('start_dt')
+        if saved_start_dt is None:
+            return True
+        return transform_dt_to_default_tz(saved_start_dt).utcoffset() != \
+            transform_dt_to_default_tz(self.start_dt).utcoffset()
 
     def _update_effective_dates(self):
         # Start date has to be calculated first
         self.effective_start_dt = calculate_effective_schedule_start_dt(self)
         self.effective_end_dt = calculate_effective_schedule_end_dt(self)
 
+    def _update_recurrence_checkpoints(self):
+        """
+        Store periodic anchors of complex recurrences, queries will start iterating from the nearest one
+        """
+        self.recurrence_checkpoints = ''
+        if not self.recurrences.rrules or not self.effective_start_dt:
+            return
+        start_dt = transform_dt_to_default_tz(self.start_dt)
+        try:
+            SimpleRecurrence(self.recurrences, start_dt)
+            return  # Simple recurrences are evaluated in closed form
+        except NotSimpleRecurrence:
+            pass
+        until_dt = timezone.now() + CHECKPOINTS_HORIZON
+        if self.effective_end_dt:
+            until_dt = min(until_dt, self.effective_end_dt)
+        self.recurrence_checkpoints = Checkpoints.build(self.recurrences, start_dt, until_dt).dumps()
+
+    @property
+    def checkpoints(self):
+        """
+        Parsed recurrence checkpoints, cached while the field doesn't change
+        """
+        cached = getattr(self, '_checkpoints_cache', None)
+        if cached is None or cached[0] != self.recurrence_checkpoints:
+            cached = (self.recurrence_checkpoints, Checkpoints.loads(self.recurrence_checkpoints))
+            self._checkpoints_cache = cached
+        return cached[1]
+
+    def _update_occurrences(self):
+        """
+        Regenerate the materialized occurrences of this schedule if it belongs to the active calendar
+        """
+        calendar = Calendar.objects.filter(id=self.calendar_id, is_active=True).first()
+        with transaction.atomic():
+            TransmissionOccurrence.objects.filter(schedule=self).delete()
+            if calendar and calendar.occurrences_after and calendar.occurrences_before:
+                TransmissionOccurrence.objects.bulk_create(
+                    self._build_occurrences(calendar.occurrences_after, calendar.occurrences_before)
+                )
+        bump_schedules_version()
+
+    def _build_occurrences(self, after, before):
+        return [
+            TransmissionOccurrence(
+                schedule=self, programme_id=self.programme_id, type=self.type, start=date, end=date + self.runtime
+            )
+            for date in self.dates_between(after, before)
+        ]
+
     @property
     def runtime(self):
         return self.programme.runtime
@@ -227,7 +508,8 @@ class Schedule(models.Model):
         start_dt = transform_dt_to_default_tz(self.start_dt)
 
         # We need to send the dates in the default timezone
-        recurrence_dates_between = self.recurrences.between(after_date, before_date, inc=True, dtstart=start_dt)
+        recurrence_dates_between = recurrence_between(
+            self.recurrences, after_date, before_date, start_dt, self.checkpoints)
 
         # Special case to include started episodes
         date_before = self.date_before(after_date)
@@ -237,10 +519,29 @@ class Schedule(models.Model):
         for date in recurrence_dates_between:
             yield fix_recurrence_dst(date)  # Fixing date
 
+    def dates_after(self, after):
+        """
+            Return a generator of sorted dates after a date, without upper limit
+            Dates are calculated lazily in windows which double their size
+        """
+        window = UPCOMING_WINDOW
+        last_date = None
+        while self.effective_start_dt and window <= UPCOMING_MAX_WINDOW:
+            before = after + window
+            for date in self.dates_between(after, before):
+                # Windows are inclusive and can include started transmissions, skipping repeated dates
+                if last_date is None or date > last_date:
+                    last_date = date
+                    yield date
+            if self.effective_end_dt and before >= self.effective_end_dt:
+                return
+            after = before
+            window *= 2
+
     def date_before(self, before):
         before_date = transform_dt_to_default_tz(self._merge_before(before))
         start_dt = transform_dt_to_default_tz(self.start_dt)
-        date = recurrence_before(self.recurrences, before_date, start_dt)
+        date = recurrence_before(self.recurrences, before_date, start_dt, self.checkpoints)
         return fix_recurrence_dst(date)
 
     def date_after(self, after):
@@ -249,7 +550,7 @@ class Schedule(models.Model):
             return
         after_date = transform_dt_to_default_tz(after_date)
         start_dt = transform_dt_to_default_tz(self.start_dt)
-        date = recurrence_after(self.recurrences, after_date, start_dt)
+        date = recurrence_after(self.recurrences, after_date, start_dt, self.checkpoints)
         return fix_recurrence_dst(date)
 
     def _merge_after(self, after):
@@ -318,7 +619,8 @@ def calculate_effective_schedule_end_dt(schedule):
     # If we have a programme restriction
     if programme_end_dt:
         last_effective_start_date = fix_recurrence_dst(recurrence_before(
-            schedule.recurrences, transform_dt_to_default_tz(programme_end_dt), transform_dt_to_default_tz(schedule.start_dt)))
+            schedule.recurrences, transform_dt_to_default_tz(programme_end_dt),
+            transform_dt_to_default_tz(schedule.start_dt), schedule.checkpoints))
         if last_effective_start_date:
             if programme_start_dt and programme_start_dt > last_effective_start_date:
                 return None
@@ -336,8 +638,9 @@ def calculate_effective_schedule_end_dt(schedule):
 
     # Get the biggest possible start_date. It could be that the biggest date is excluded
     biggest_date = max(possible_limit_dates)
-    last_effective_start_date = schedule.recurrences.before(
-        transform_dt_to_default_tz(biggest_date), True, dtstart=transform_dt_to_default_tz(schedule.start_dt))
+    last_effective_start_date = rruleset_before(
+        schedule.recurrences, transform_dt_to_default_tz(biggest_date), transform_dt_to_default_tz(schedule.start_dt),
+        schedule.checkpoints)
     if last_effective_start_date:
         if programme_start_dt and programme_start_dt > last_effective_start_date:
             return None
@@ -345,6 +648,77 @@ def calculate_effective_schedule_end_dt(schedule):
     return None
 
 
+def update_effective_dates(schedules, rearrange=True):
+    """
+    Recalculate the effective dates and the recurrence checkpoints of the given schedules in memory and store only
+    the ones which changed
+    The episodes of every affected programme are rearranged only once
+
+    Returns: the list of schedules which changed
+    """
+    fields = ['effective_start_dt', 'effective_end_dt', 'recurrence_checkpoints']
+    changed = []
+    for schedule in schedules:
+        values = [getattr(schedule, _field) for _field in fields]
+        schedule._update_effective_dates()
+        schedule._update_recurrence_checkpoints()
+        if [getattr(schedule, _field) for _field in fields] != values:
+            changed.append(schedule)
+    if not changed:
+        return changed
+
+    update_in_batches(Schedule, changed, fields)
+
+    calendar = Calendar.get_active()
+    if calendar:
+        active_schedules = [_schedule for _schedule in changed if _schedule.calendar_id == calendar.id]
+        for schedule in active_schedules:
+            schedule._update_occurrences()
+        if rearrange:
+            programmes = {_schedule.programme_id: _schedule.programme for _schedule in active_schedules}
+            for programme in programmes.values():
+                rearrange_episodes(programme, timezone.now(), calendar)
+    return changed
+
+
+class TransmissionOccurrence(models.Model):
+    """
+    Materialized transmission of the active calendar, helper to improve performance
+    """
+    schedule = models.ForeignKey(Schedule)
+    programme = models.ForeignKey(Programme)
+    start = models.DateTimeField(db_index=True)
+    end = models.DateTimeField(db_index=True)
+    type = models.CharField(choices=EMISSION_TYPE, max_length=1)
+
+
+def update_occurrences_runtime(sender, instance, created, **kwargs):
+    if not created and instance._runtime and '_runtime' in instance.changed_fields:
+        TransmissionOccurrence.objects.filter(programme=instance).update(end=F('start') + instance.runtime)
+
+
+post_save.connect(
+    update_occurrences_runtime, sender=Programme, dispatch_uid='update_occurrences_runtime')
+
+
+def update_schedules_version(sender, **kwargs):
+    bump_schedules_version()
+
+
+def update_active_calendar(sender, **kwargs):
+    local_cache.invalidate()
+
+
+for model in (Calendar, Schedule, ExcludedDates, Programme, Episode, Podcast):
+    post_save.connect(
+        update_schedules_version, sender=model, dispatch_uid='update_schedules_version_%s' % model.__name__)
+    post_delete.connect(
+        update_schedules_version, sender=model, dispatch_uid='delete_schedules_version_%s' % model.__name__)
+
+post_save.connect(update_active_calendar, sender=Calendar, dispatch_uid='update_active_calendar')
+post_delete.connect(update_active_calendar, sender=Calendar, dispatch_uid='delete_active_calendar')
+
+
 class Transmission(object):
     """
     Temporal object generated according to recurrence rules or schedule information
@@ -383,22 +757,39 @@ class Transmission(object):
 
     @classmethod
     def at(cls, at):
+        # What is on air now is read from the in-memory index
+        index = intervals.get_index(at)
+        if index is not None:
+            for transmission in index.at(at):
+                yield transmission
+            return
+
+        active = Calendar.get_active_horizon()
+        if active and active.covers(at, at):
+            occurrences = TransmissionOccurrence.objects.filter(
+                start__lte=at, end__gt=at
+            ).select_related('schedule__programme').order_by('start', 'schedule_id')
+            transmissions = (
+                cls(_occurrence.schedule, transform_dt_to_default_tz(_occurrence.start))
+                for _occurrence in occurrences
+            )
+            for transmission in cls.with_episodes(transmissions):
+                yield transmission
+            return
+
         schedules = Schedule.objects.filter(
-            calendar__is_active=True, effective_start_dt__lte=at
+            calendar_id=Calendar.get_active_id(), effective_start_dt__lte=at
         ).filter(
             Q(effective_end_dt__gt=at) |
             Q(effective_end_dt__isnull=True)
         ).select_related('programme')
+        transmissions = []
         for schedule in schedules:
             date = schedule.date_before(at)
             if date and date <= at < date + schedule.runtime:
-                # Get episode
-                try:
-                    episode = Episode.objects.get(issue_date=date)
-                except Episode.DoesNotExist:
-                    episode = None
-                # yield transmission
-                yield cls(schedule, date, episode)
+                transmissions.append(cls(schedule, date))
+        for transmission in cls.with_episodes(transmissions):
+            yield transmission
 
     @classmethod
     def between(cls, after, before, schedules=None):
@@ -406,7 +797,7 @@ class Transmission(object):
         Return a tuple of Schedule and Transmissions sorted by date
         """
         if schedules is None:
-            schedules = Schedule.objects.filter(calendar__is_active=True)
+            schedules = Schedule.objects.filter(calendar_id=Calendar.get_active_id())
 
         schedules = schedules.filter(
             effective_start_dt__lt=before
@@ -415,21 +806,145 @@ class Transmission(object):
             Q(effective_end_dt__isnull=True)
         ).select_related('programme')
 
-        # Querying episodes episodes in that period of time
-        episodes = Episode.objects.filter(
-            issue_date__lt=before, issue_date__gte=after
-        )
-        episodes = {_episode.issue_date: _episode for _episode in episodes}
-
-        transmission_dates = [
+        transmission_dates = []
+        active = Calendar.get_active_horizon()
+        if active and active.covers(after, before):
+            # Schedules of the active calendar are read from the occurrence table
+            materialized_schedules = {
+                _schedule.id: _schedule for _schedule in schedules if _schedule.calendar_id == active.calendar_id
+            }
+            schedules = [_schedule for _schedule in schedules if _schedule.calendar_id != active.calendar_id]
+            if materialized_schedules:
+                occurrences = TransmissionOccurrence.objects.filter(
+                    schedule__in=materialized_schedules.keys(), start__lte=before, end__gt=after
+                ).order_by('start', 'schedule_id').values_list('start', 'schedule_id')
+                transmission_dates.append(
+                    (transform_dt_to_default_tz(_start), materialized_schedules[_schedule_id])
+                    for _start, _schedule_id in occurrences.iterator()
+                )
+
+        if batch.is_available():
+            # Regular schedules are expanded at once
+            batchable, schedules = batch.split_schedules(schedules)
+            if batchable:
+                transmission_dates.append(iter(batch.expand(batchable, after, before)))
+
+        transmission_dates.extend(
             imap(partial(_return_tuple, item2=schedule), schedule.dates_between(after, before))
             for schedule in schedules
-        ]
+        )
         sorted_transmission_dates = heapq.merge(*transmission_dates)
-        for sorted_transmission_date, schedule in sorted_transmission_dates:
-            # Adding episodes matching by date, we don't care about if this info is not correct
-            yield cls(schedule, sorted_transmission_date, episodes.get(sorted_transmission_date))
+        transmissions = (cls(_schedule, _date) for _date, _schedule in sorted_transmission_dates)
+        for transmission in cls.with_episodes(transmissions):
+            yield transmission
+
+    @classmethod
+    def next_change(cls, at):
+        """
+        Return the next date when a transmission starts or ends, None if there are no more transmissions
+        """
+        index = intervals.get_index(at)
+        if index is not None:
+            date = index.next_change(at)
+            if date:
+                return date
+
+        on_air = list(cls.at(at))
+        dates = [_transmission.end for _transmission in on_air]
+        dates.extend(
+            _transmission.start for _transmission in cls.upcoming(at, len(on_air) + 1) if _transmission.start > at
+        )
+        return min(dates) if dates else None
+
+    @classmethod
+    def upcoming(cls, after, limit, schedules=None):
+        """
+        Return the next `limit` Transmissions sorted by date, started transmissions included
+        Dates are generated lazily and the merge stops as soon as enough transmissions are produced
+        """
+        if schedules is None:
+            schedules = Schedule.objects.filter(calendar_id=Calendar.get_active_id())
+
+        schedules = schedules.filter(
+            Q(effective_end_dt__gt=after) |
+            Q(effective_end_dt__isnull=True)
+        ).select_related('programme')
+
+        transmission_dates = []
+        active = Calendar.get_active_horizon()
+        if active and active.covers(after, after):
+            # Schedules of the active calendar are read from the occurrence table until its horizon
+            materialized_schedules = {
+                _schedule.id: _schedule for _schedule in schedules if _schedule.calendar_id == active.calendar_id
+            }
+            schedules = [_schedule for _schedule in schedules if _schedule.calendar_id != active.calendar_id]
+            if materialized_schedules:
+                horizon = active.before
+                occurrences = TransmissionOccurrence.objects.filter(
+                    schedule__in=materialized_schedules.keys(), start__lt=horizon, end__gt=after
+                ).order_by('start', 'schedule_id').values_list('start', 'schedule_id')[:limit]
+                transmission_dates.append(chain(
+                    (
+                        (transform_dt_to_default_tz(_start), materialized_schedules[_schedule_id])
+                        for _start, _schedule_id in occurrences.iterator()
+                    ),
+                    heapq.merge(*[
+                        _dates_from(_schedule, horizon) for _schedule in materialized_schedules.values()
+                    ])
+                ))
+
+        transmission_dates.extend(
+            imap(partial(_return_tuple, item2=schedule), schedule.dates_after(after))
+            for schedule in schedules
+        )
+        sorted_transmission_dates = islice(heapq.merge(*transmission_dates), limit)
+        transmissions = (cls(_schedule, _date) for _date, _schedule in sorted_transmission_dates)
+        for transmission in cls.with_episodes(transmissions):
+            yield transmission
+
+    @staticmethod
+    def with_episodes(transmissions):
+        """
+        Adds the episode of every transmission, matching by programme and date
+        Episodes are fetched in batches while the transmissions are consumed
+        """
+        transmissions = iter(transmissions)
+        while True:
+            chunk = list(islice(transmissions, EPISODES_BATCH_SIZE))
+            if not chunk:
+                return
+            episodes = Episode.objects.by_issue_date(
+                (_transmission.schedule.programme_id, _transmission.start) for _transmission in chunk
+            )
+            for transmission in chunk:
+                transmission.episode = episodes.get((transmission.schedule.programme_id, transmission.start))
+                yield transmission
+
+    @staticmethod
+    def create_missing_episodes(transmissions):
+        """
+        Creates at once the episodes of the given transmissions which don't have one yet
+
+        Returns: the number of episodes created by this call, not counting the ones created meanwhile by other
+        processes
+        """
+        missing = [_transmission for _transmission in transmissions if not _transmission.episode]
+        if not missing:
+            return 0
+        episodes, created = Episode.objects.create_episodes(
+            (_transmission.start, _transmission.programme) for _transmission in missing
+        )
+        for transmission in missing:
+            transmission.episode = episodes[(transmission.programme.id, transmission.start)]
+        return created
 
 
 def _return_tuple(item1, item2):
     return item1, item2
+
+
+def _dates_from(schedule, after):
+    """
+    Tuples of date and schedule starting exactly after a date, transmissions started before are not included
+    """
+    return ((_date, schedule) for _date in schedule.dates_after(after) if _date >= after)
@@ -0,0 +1,93 @@
+import datetime
+import heapq
+from unittest import skipUnless
+
+import recurrence
+from django.test import TestCase
+from django.test import override_settings
+
+from radioco.apps.programmes.models import Programme
+from radioco.apps.radioco.test_utils import TestDataMixin, SPAIN_TZ
+from radioco.apps.radioco.tz_utils import fix_recurrence_date
+from radioco.apps.schedules import batch
+from radioco.apps.schedules.models import Schedule
+
+
+@skipUnless(batch.is_available(), 'numpy is not installed')
+@override_settings(TIME_ZONE='Europe/Madrid')
+class BatchExpansionTests(TestDataMixin, TestCase):
+    def setUp(self):
+        self.programme = Programme.objects.create(
+            name='Batch', current_season=1, _runtime=90, start_date=datetime.date(2017, 1, 1))
+        self.rrules = [
+            recurrence.Rule(recurrence.DAILY),
+            recurrence.Rule(recurrence.DAILY, interval=3, count=40),
+            recurrence.Rule(recurrence.WEEKLY, byday=[recurrence.MO, recurrence.FR]),
+            recurrence.Rule(recurrence.WEEKLY, byday=[recurrence.SU], interval=2, wkst=recurrence.SU),
+            recurrence.Rule(
+                recurrence.WEEKLY, byday=[recurrence.TU, recurrence.SA],
+                until=SPAIN_TZ.localize(datetime.datetime(2017, 5, 2))),
+        ]
+        start_dts = [
+            SPAIN_TZ.localize(datetime.datetime(2017, 1, 4, 14, 0, 0)),
+            SPAIN_TZ.localize(datetime.datetime(2017, 1, 4, 2, 30, 0)),
+            SPAIN_TZ.localize(datetime.datetime(2017, 7, 1, 2, 30, 0)),
+            SPAIN_TZ.localize(datetime.datetime(2016, 12, 20, 23, 0, 0)),
+        ]
+        for rrule in self.rrules:
+            for start_dt in start_dts:
+                schedule = Schedule.objects.create(
+                    programme=self.programme, type='L', calendar=self.calendar, start_dt=start_dt,
+                    recurrences=recurrence.Recurrence(rrules=[rrule]))
+                schedule.exclude_date(fix_recurrence_date(start_dt, SPAIN_TZ.localize(datetime.datetime(2017, 3, 27))))
+                schedule.save()
+        self.schedules = list(Schedule.objects.filter(programme=self.programme).select_related('programme'))
+
+    def _dates_between(self, schedules, after, before):
+        return list(heapq.merge(*[
+            [(_date, _schedule) for _date in _schedule.dates_between(after, before)] for _schedule in schedules
+        ]))
+
+    def _assert_expansion(self, after, before):
+        expected = self._dates_between(self.schedules, after, before)
+        dates = list(batch.expand(self.schedules, after, before))
+        self.assertItemsEqual(
+            [(_date, _schedule.id) for _date, _schedule in dates],
+            [(_date, _schedule.id) for _date, _schedule in expected])
+        self.assertEqual([_date for _date, _schedule in dates], [_date for _date, _schedule in expected])
+
+    def test_split_schedules(self):
+        not_simple = Schedule.objects.create(
+            programme=self.programme, type='L', calendar=self.calendar,
+            start_dt=SPAIN_TZ.localize(datetime.datetime(2017, 1, 4, 14, 0, 0)),
+            recurrences=recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.MONTHLY)]))
+        without_rules = Schedule.objects.create(
+            programme=self.programme, type='L', calendar=self.calendar,
+            start_dt=SPAIN_TZ.localize(datetime.datetime(2017, 1, 4, 14, 0, 0)))
+        batchable, others = batch.split_schedules(self.schedules + [not_simple, without_rules])
+        self.assertListEqual(batchable, self.schedules)
+        self.assertListEqual(others, [not_simple, without_rules])
+
+    def test_expand_week(self):
+        self._assert_expansion(
+            SPAIN_TZ.localize(datetime.datetime(2017, 1, 9)), SPAIN_TZ.localize(datetime.datetime(2017, 1, 15)))
+
+    def test_expand_started_transmissions(self):
+        self._assert_expansion(
+            SPAIN_TZ.localize(datetime.datetime(2017, 1, 9, 14, 30)),
+            SPAIN_TZ.localize(datetime.datetime(2017, 1, 15, 14, 0)))
+
+    def test_expand_dst_transitions(self):
+        self._assert_expansion(
+            SPAIN_TZ.localize(datetime.datetime(2017, 3, 20)), SPAIN_TZ.localize(datetime.datetime(2017, 4, 10)))
+        self._assert_expansion(
+            SPAIN_TZ.localize(datetime.datetime(2017, 10, 20)), SPAIN_TZ.localize(datetime.datetime(2017, 11, 10)))
+
+    def test_expand_before_start(self):
+        self._assert_expansion(
+            SPAIN_TZ.localize(datetime.datetime(2016, 12, 1)), SPAIN_TZ.localize(datetime.datetime(2017, 2, 1)))
+
+    def test_expand_empty(self):
+        self.assertEqual(len(batch.expand([], self.schedules[0].start_dt, self.schedules[0].start_dt)), 0)
+        self._assert_expansion(
+            SPAIN_TZ.localize(datetime.datetime(2014, 12, 1)), SPAIN_TZ.localize(datetime.datetime(2015, 2, 1)))
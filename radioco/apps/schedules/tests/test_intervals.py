@@ -0,0 +1,77 @@
+import datetime
+
+import mock
+from django.test import TestCase
+from django.test import override_settings
+from pytz import utc
+
+from radioco.apps.radioco.test_utils import TestDataMixin
+from radioco.apps.schedules import intervals
+from radioco.apps.schedules.models import Schedule, Transmission
+
+
+def mock_now(dt=utc.localize(datetime.datetime(2015, 1, 6, 10, 0, 0))):
+    return dt
+
+
+def _transmissions(transmissions):
+    return map(lambda t: (t.slug, t.start, t.schedule.id, t.episode), transmissions)
+
+
+@override_settings(TIME_ZONE='UTC')
+class TransmissionIndexTests(TestDataMixin, TestCase):
+    def setUp(self):
+        patcher = mock.patch('django.utils.timezone.now', mock_now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(intervals, 'TRANSMISSION_INDEX_HOURS', 24)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        intervals._index = None
+        self.addCleanup(setattr, intervals, '_index', None)
+
+    def _at_without_index(self, at):
+        with mock.patch.object(intervals, 'TRANSMISSION_INDEX_HOURS', 0):
+            return _transmissions(Transmission.at(at))
+
+    def test_at(self):
+        at = utc.localize(datetime.datetime(2015, 1, 6, 10, 0, 0))
+        while at < utc.localize(datetime.datetime(2015, 1, 7, 10, 0, 0)):
+            self.assertListEqual(_transmissions(Transmission.at(at)), self._at_without_index(at))
+            at += datetime.timedelta(minutes=15)
+
+    def test_at_without_queries(self):
+        at = utc.localize(datetime.datetime(2015, 1, 6, 12, 30, 0))
+        list(Transmission.at(at))
+        with self.assertNumQueries(0):
+            self.assertListEqual(
+                map(lambda t: (t.slug, t.start), Transmission.at(at)),
+                [(u'local-gossips', utc.localize(datetime.datetime(2015, 1, 6, 12, 0, 0)))])
+
+    def test_dates_outside_of_the_index(self):
+        at = utc.localize(datetime.datetime(2015, 1, 8, 12, 30, 0))
+        self.assertListEqual(_transmissions(Transmission.at(at)), self._at_without_index(at))
+        self.assertIsNone(intervals.get_index(at))
+
+    def test_rebuild_after_changes(self):
+        at = utc.localize(datetime.datetime(2015, 1, 6, 14, 30, 0))
+        index = intervals.get_index(at)
+        self.assertListEqual(
+            map(lambda t: t.slug, Transmission.at(at)), [u'classic-hits'])
+
+        schedule = Schedule.objects.get(programme=self.programme, calendar=self.calendar)
+        schedule.exclude_date(utc.localize(datetime.datetime(2015, 1, 6, 14, 0, 0)))
+        schedule.save()
+        self.assertListEqual(list(Transmission.at(at)), [])
+        self.assertIsNot(intervals.get_index(at), index)
+
+    def test_next_change(self):
+        at = utc.localize(datetime.datetime(2015, 1, 6, 12, 30, 0))
+        self.assertEqual(Transmission.next_change(at), utc.localize(datetime.datetime(2015, 1, 6, 13, 0, 0)))
+        at = utc.localize(datetime.datetime(2015, 1, 6, 13, 0, 0))
+        self.assertEqual(Transmission.next_change(at), utc.localize(datetime.datetime(2015, 1, 6, 14, 0, 0)))
+
+        with mock.patch.object(intervals, 'TRANSMISSION_INDEX_HOURS', 0):
+            self.assertEqual(Transmission.next_change(at), utc.localize(datetime.datetime(2015, 1, 6, 14, 0, 0)))
+            at = utc.localize(datetime.datetime(2015, 1, 6, 14, 30, 0))
+            self.assertEqual(Transmission.next_change(at), utc.localize(datetime.datetime(2015, 1, 6, 15, 0, 0)))
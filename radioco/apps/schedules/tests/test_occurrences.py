@@ -0,0 +1,147 @@
+import datetime
+
+import mock
+import recurrence
+from django.db import connection
+from django.test import TestCase
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from pytz import utc
+
+from radioco.apps.radioco import local_cache
+from radioco.apps.radioco.test_utils import TestDataMixin
+from radioco.apps.schedules.models import Calendar, Schedule, Transmission, TransmissionOccurrence
+
+
+def mock_now(dt=utc.localize(datetime.datetime(2015, 1, 5, 12, 0, 0))):
+    return dt
+
+
+def _transmissions(transmissions):
+    return map(lambda t: (t.slug, t.start, t.schedule.id), transmissions)
+
+
+@override_settings(TIME_ZONE='UTC')
+class TransmissionOccurrenceTests(TestDataMixin, TestCase):
+    def setUp(self):
+        patcher = mock.patch('django.utils.timezone.now', mock_now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.schedule = Schedule.objects.get(programme=self.programme, calendar=self.calendar)
+        self.calendar.materialize_occurrences()
+        self.after = utc.localize(datetime.datetime(2015, 1, 6, 11, 30, 0))
+        self.before = utc.localize(datetime.datetime(2015, 1, 9, 17, 0, 0))
+
+    def _between_without_occurrences(self, after, before, schedules=None):
+        Calendar.objects.filter(id=self.calendar.id).update(occurrences_after=None, occurrences_before=None)
+        try:
+            return _transmissions(Transmission.between(after, before, schedules=schedules))
+        finally:
+            self.calendar.materialize_occurrences()
+
+    def test_horizon(self):
+        calendar = Calendar.get_active()
+        self.assertEqual(calendar.occurrences_after, utc.localize(datetime.datetime(2014, 12, 29, 12, 0, 0)))
+        self.assertEqual(calendar.occurrences_before, utc.localize(datetime.datetime(2015, 3, 6, 12, 0, 0)))
+        self.assertTrue(calendar.has_occurrences_between(self.after, self.before))
+        self.assertFalse(calendar.has_occurrences_between(
+            utc.localize(datetime.datetime(2014, 1, 1)), self.before))
+
+    def test_horizon_in_memory(self):
+        with mock.patch.object(local_cache, 'is_cache_shared', return_value=True):
+            self.assertEqual(
+                Calendar.get_active_horizon(),
+                (self.calendar.id, utc.localize(datetime.datetime(2014, 12, 29, 12, 0, 0)),
+                 utc.localize(datetime.datetime(2015, 3, 6, 12, 0, 0))))
+            with CaptureQueriesContext(connection) as queries:
+                list(Transmission.at(self.after))
+                list(Transmission.between(self.after, self.before))
+                list(Transmission.upcoming(self.after, 3))
+            self.assertFalse([_query for _query in queries if '"schedules_calendar"' in _query['sql']])
+
+            # Moving the horizon outdates it
+            self.calendar.materialize_occurrences(mock_now() + datetime.timedelta(days=1))
+            self.assertEqual(
+                Calendar.get_active_horizon().before, utc.localize(datetime.datetime(2015, 3, 7, 12, 0, 0)))
+
+    def test_occurrences_only_for_active_calendar(self):
+        self.assertFalse(TransmissionOccurrence.objects.exclude(schedule__calendar=self.calendar).exists())
+        self.assertTrue(TransmissionOccurrence.objects.filter(schedule=self.schedule).exists())
+
+    def test_between(self):
+        self.assertListEqual(
+            _transmissions(Transmission.between(self.after, self.before)),
+            self._between_without_occurrences(self.after, self.before))
+
+    def test_between_includes_started_transmission(self):
+        between = _transmissions(Transmission.between(self.after, self.before))
+        self.assertEqual(between[0][:2], (u'the-best-wine', utc.localize(datetime.datetime(2015, 1, 6, 11, 0, 0))))
+
+    def test_between_mixing_calendars(self):
+        schedules = Schedule.objects.filter(programme=self.programme)
+        self.assertListEqual(
+            _transmissions(Transmission.between(self.after, self.before, schedules=schedules)),
+            self._between_without_occurrences(self.after, self.before, schedules=schedules))
+
+    def test_upcoming(self):
+        between = _transmissions(Transmission.between(self.after, self.before))
+        self.assertListEqual(_transmissions(Transmission.upcoming(self.after, len(between))), between)
+        self.assertListEqual(_transmissions(Transmission.upcoming(self.after, 3)), between[:3])
+
+    def test_upcoming_after_horizon(self):
+        calendar = Calendar.get_active()
+        after = calendar.occurrences_before - datetime.timedelta(days=2)
+        before = calendar.occurrences_before + datetime.timedelta(days=2)
+        between = _transmissions(Transmission.between(after, before))
+        self.assertListEqual(_transmissions(Transmission.upcoming(after, len(between))), between)
+
+    def test_upcoming_without_occurrences(self):
+        between = _transmissions(Transmission.between(self.after, self.before))
+        Calendar.objects.filter(id=self.calendar.id).update(occurrences_after=None, occurrences_before=None)
+        self.assertListEqual(_transmissions(Transmission.upcoming(self.after, len(between))), between)
+
+    def test_at(self):
+        now = Transmission.at(utc.localize(datetime.datetime(2015, 1, 6, 12, 59, 59)))
+        self.assertListEqual(
+            map(lambda t: (t.slug, t.start), list(now)),
+            [(u'local-gossips', utc.localize(datetime.datetime(2015, 1, 6, 12, 0, 0)))])
+
+    def test_schedule_save(self):
+        self.schedule.exclude_date(utc.localize(datetime.datetime(2015, 1, 7, 14, 0, 0)))
+        self.schedule.save()
+        self.assertFalse(TransmissionOccurrence.objects.filter(
+            schedule=self.schedule, start=utc.localize(datetime.datetime(2015, 1, 7, 14, 0, 0))).exists())
+        self.assertListEqual(
+            _transmissions(Transmission.between(self.after, self.before)),
+            self._between_without_occurrences(self.after, self.before))
+
+    def test_schedule_new(self):
+        schedule = Schedule.objects.create(
+            programme=self.programme,
+            type='B',
+            calendar=self.calendar,
+            recurrences=recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.WEEKLY)]),
+            start_dt=utc.localize(datetime.datetime(2015, 1, 1, 20, 0, 0)))
+        self.assertListEqual(
+            list(TransmissionOccurrence.objects.filter(
+                schedule=schedule, start__lt=self.before).order_by('start').values_list('start', 'type')),
+            [(utc.localize(datetime.datetime(2015, 1, 1, 20, 0, 0)), u'B'),
+             (utc.localize(datetime.datetime(2015, 1, 8, 20, 0, 0)), u'B')])
+
+    def test_schedule_delete(self):
+        self.schedule.delete()
+        self.assertFalse(TransmissionOccurrence.objects.filter(programme=self.programme).exists())
+
+    def test_programme_runtime(self):
+        self.programme.runtime = 90
+        self.programme.save()
+        occurrence = TransmissionOccurrence.objects.filter(programme=self.programme).first()
+        self.assertEqual(occurrence.end, occurrence.start + datetime.timedelta(minutes=90))
+
+    def test_calendar_activation(self):
+        self.another_calendar.is_active = True
+        self.another_calendar.save()
+        self.assertEqual(Calendar.objects.get(id=self.calendar.id).occurrences_before, None)
+        self.assertListEqual(
+            list(TransmissionOccurrence.objects.values_list('schedule__calendar', flat=True).distinct()),
+            [self.another_calendar.id])
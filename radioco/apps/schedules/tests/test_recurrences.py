@@ -17,9 +17,12 @@ import datetime
 
 import recurrence
 from django.test import TestCase
+from django.test import override_settings
 
-from radioco.apps.radioco.test_utils import TestDataMixin
-from radioco.apps.radioco.tz_utils import recurrence_after, recurrence_before
+from radioco.apps.radioco.recurrence_utils import SimpleRecurrence, NotSimpleRecurrence, Checkpoints
+from radioco.apps.radioco.test_utils import TestDataMixin, SPAIN_TZ
+from radioco.apps.radioco.tz_utils import recurrence_after, recurrence_before, recurrence_between, \
+    fix_recurrence_date, fix_recurrence_dst
 
 
 class RecurrenceTests(TestDataMixin, TestCase):
@@ -180,3 +183,145 @@ class EmptyRecurrenceTests(TestDataMixin, TestCase):
 
         before = datetime.datetime(2014, 1, 1, 13, 59, 59)
         self.assertIsNone(self.empty_recurrence.before(before, True, dtstart=start_dt))
+
+
+@override_settings(TIME_ZONE='Europe/Madrid')
+class SimpleRecurrenceTests(TestCase):
+    """
+    Tests to check that the closed-form evaluation returns the same results as django-recurrence
+    """
+    def setUp(self):
+        self.start_dt = SPAIN_TZ.localize(datetime.datetime(2017, 1, 4, 14, 0, 0))
+        self.exdates = [
+            fix_recurrence_date(self.start_dt, SPAIN_TZ.localize(datetime.datetime(2017, 3, 27))),
+            fix_recurrence_date(self.start_dt, SPAIN_TZ.localize(datetime.datetime(2017, 4, 5))),
+        ]
+        self.rrules = [
+            recurrence.Rule(recurrence.DAILY),
+            recurrence.Rule(recurrence.DAILY, interval=3, count=40),
+            recurrence.Rule(recurrence.WEEKLY),
+            recurrence.Rule(recurrence.WEEKLY, byday=[recurrence.MO, recurrence.FR]),
+            recurrence.Rule(recurrence.WEEKLY, byday=[recurrence.MO, recurrence.WE], interval=2, wkst=recurrence.SU),
+            recurrence.Rule(
+                recurrence.WEEKLY, byday=[recurrence.TU, recurrence.SA],
+                until=SPAIN_TZ.localize(datetime.datetime(2017, 5, 2, 23, 59, 59))),
+        ]
+        self.dates = [
+            self.start_dt - datetime.timedelta(days=3),
+            self.start_dt,
+            SPAIN_TZ.localize(datetime.datetime(2017, 3, 25, 15, 0, 0)),
+            SPAIN_TZ.localize(datetime.datetime(2017, 3, 27, 14, 0, 0)),
+            SPAIN_TZ.localize(datetime.datetime(2017, 4, 5, 13, 0, 0)),
+            SPAIN_TZ.localize(datetime.datetime(2017, 10, 29, 23, 0, 0)),
+            SPAIN_TZ.localize(datetime.datetime(2018, 6, 1)),
+        ]
+
+    def _recurrences(self):
+        for rrule in self.rrules:
+            yield recurrence.Recurrence(rrules=[rrule], exdates=self.exdates)
+        yield recurrence.Recurrence(rrules=self.rrules[3:5], exdates=self.exdates)
+
+    def test_is_simple(self):
+        for _recurrence in self._recurrences():
+            SimpleRecurrence(_recurrence, self.start_dt)
+
+    def test_not_simple(self):
+        with self.assertRaises(NotSimpleRecurrence):
+            SimpleRecurrence(recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.MONTHLY)]), self.start_dt)
+        with self.assertRaises(NotSimpleRecurrence):
+            SimpleRecurrence(recurrence.Recurrence(
+                rrules=[recurrence.Rule(recurrence.DAILY)],
+                exrules=[recurrence.Rule(recurrence.WEEKLY)]), self.start_dt)
+        with self.assertRaises(NotSimpleRecurrence):
+            SimpleRecurrence(recurrence.Recurrence(
+                rrules=[recurrence.Rule(recurrence.WEEKLY, byday=[recurrence.MO(1)])]), self.start_dt)
+
+    def test_after(self):
+        for _recurrence in self._recurrences():
+            for dt in self.dates:
+                self.assertEqual(
+                    fix_recurrence_dst(recurrence_after(_recurrence, dt, self.start_dt)),
+                    fix_recurrence_dst(_recurrence.after(dt, True, dtstart=self.start_dt)))
+
+    def test_before(self):
+        for _recurrence in self._recurrences():
+            for dt in self.dates:
+                self.assertEqual(
+                    fix_recurrence_dst(recurrence_before(_recurrence, dt, self.start_dt)),
+                    fix_recurrence_dst(_recurrence.before(dt, True, dtstart=self.start_dt)))
+
+    def test_between(self):
+        for _recurrence in self._recurrences():
+            for after, before in zip(self.dates, self.dates[1:]):
+                self.assertListEqual(
+                    map(fix_recurrence_dst, recurrence_between(_recurrence, after, before, self.start_dt)),
+                    map(fix_recurrence_dst, _recurrence.between(after, before, inc=True, dtstart=self.start_dt)))
+
+
+@override_settings(TIME_ZONE='Europe/Madrid')
+class CheckpointsTests(TestCase):
+    """
+    Tests to check that starting from a checkpoint returns the same results as django-recurrence
+    """
+    def setUp(self):
+        self.start_dt = SPAIN_TZ.localize(datetime.datetime(2017, 1, 31, 14, 0, 0))
+        self.exdates = [
+            fix_recurrence_date(self.start_dt, SPAIN_TZ.localize(datetime.datetime(2017, 3, 31))),
+            fix_recurrence_date(self.start_dt, SPAIN_TZ.localize(datetime.datetime(2017, 10, 2))),
+        ]
+        self.rrules = [
+            recurrence.Rule(recurrence.MONTHLY),
+            recurrence.Rule(recurrence.MONTHLY, bymonthday=[1, -1], count=15),
+            recurrence.Rule(recurrence.MONTHLY, byday=[recurrence.MO(1)], interval=2),
+            recurrence.Rule(recurrence.YEARLY, bymonth=[3, 10]),
+            recurrence.Rule(recurrence.DAILY, byhour=[14, 20], count=300),
+        ]
+        self.exrules = [recurrence.Rule(recurrence.WEEKLY, byday=[recurrence.SU])]
+        self.dates = [
+            self.start_dt - datetime.timedelta(days=3),
+            self.start_dt,
+            SPAIN_TZ.localize(datetime.datetime(2017, 3, 26, 15, 0, 0)),
+            SPAIN_TZ.localize(datetime.datetime(2017, 7, 1, 14, 0, 0)),
+            SPAIN_TZ.localize(datetime.datetime(2017, 10, 29, 23, 0, 0)),
+            SPAIN_TZ.localize(datetime.datetime(2018, 6, 1)),
+            SPAIN_TZ.localize(datetime.datetime(2019, 6, 1)),
+        ]
+        until_dt = SPAIN_TZ.localize(datetime.datetime(2018, 12, 31))
+        self.recurrences = []
+        for rrules, exrules in [(self.rrules[:1], []), (self.rrules[1:3], self.exrules), (self.rrules[3:], [])]:
+            _recurrence = recurrence.Recurrence(rrules=rrules, exrules=exrules, exdates=self.exdates)
+            checkpoints = Checkpoints.loads(Checkpoints.build(_recurrence, self.start_dt, until_dt).dumps())
+            self.recurrences.append((_recurrence, checkpoints))
+
+    def test_rruleset_starts_in_checkpoint(self):
+        _recurrence, checkpoints = self.recurrences[0]
+        self.assertIsNone(checkpoints.rruleset(_recurrence, self.start_dt, self.start_dt))
+        self.assertIsNotNone(checkpoints.rruleset(_recurrence, self.start_dt, self.dates[-1]))
+
+    def test_invalid_checkpoints(self):
+        _recurrence, checkpoints = self.recurrences[0]
+        self.assertIsNone(checkpoints.rruleset(
+            _recurrence, self.start_dt + datetime.timedelta(hours=1), self.dates[-1]))
+        self.assertIsNone(checkpoints.rruleset(
+            recurrence.Recurrence(rrules=self.rrules[3:4]), self.start_dt, self.dates[-1]))
+
+    def test_after(self):
+        for _recurrence, checkpoints in self.recurrences:
+            for dt in self.dates:
+                self.assertEqual(
+                    fix_recurrence_dst(recurrence_after(_recurrence, dt, self.start_dt, checkpoints)),
+                    fix_recurrence_dst(_recurrence.after(dt, True, dtstart=self.start_dt)))
+
+    def test_before(self):
+        for _recurrence, checkpoints in self.recurrences:
+            for dt in self.dates:
+                self.assertEqual(
+                    fix_recurrence_dst(recurrence_before(_recurrence, dt, self.start_dt, checkpoints)),
+                    fix_recurrence_dst(_recurrence.before(dt, True, dtstart=self.start_dt)))
+
+    def test_between(self):
+        for _recurrence, checkpoints in self.recurrences:
+            for after, before in zip(self.dates, self.dates[1:]):
+                self.assertListEqual(
+                    map(fix_recurrence_dst, recurrence_between(_recurrence, after, before, self.start_dt, checkpoints)),
+                    map(fix_recurrence_dst, _recurrence.between(after, before, inc=True, dtstart=self.start_dt)))
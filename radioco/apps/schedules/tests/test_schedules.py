@@ -14,6 +14,8 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import datetime
+import multiprocessing
+from StringIO import StringIO
 from functools import partial
 
 import mock
@@ -21,19 +23,22 @@ import pytz
 import recurrence
 from django.contrib.admin import AdminSite
 from django.core.exceptions import ValidationError, FieldError
+from django.core.management import call_command
 from django.core.urlresolvers import reverse
+from django.db import connection
 from django.forms import modelform_factory
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
 from django.test import override_settings
 from django.utils import timezone
 from pytz import utc
 
 from radioco.apps.programmes.models import Programme, Episode
-from radioco.apps.radioco.test_utils import TestDataMixin
+from radioco.apps.radioco.test_utils import TestDataMixin, create_test_data
 from radioco.apps.schedules.admin import CalendarAdmin
-from radioco.apps.schedules.models import Calendar, CalendarManager
-from radioco.apps.schedules.models import Schedule, Transmission
-from radioco.apps.schedules.utils import next_dates
+from radioco.apps.schedules.activation import run_activation, run_pending_activations
+from radioco.apps.schedules.models import Calendar, CalendarManager, CalendarActivation
+from radioco.apps.schedules.models import Schedule, Transmission, ExcludedDates, update_effective_dates
+from radioco.apps.schedules.utils import next_dates, coalesce_rearrangements
 
 
 def mock_now(dt=pytz.utc.localize(datetime.datetime(2014, 1, 1, 13, 30, 0))):
@@ -174,9 +179,61 @@ class ScheduleModelTests(TestDataMixin, TestCase):
              utc.localize(datetime.datetime(2014, 1, 4, 14, 0)),
              utc.localize(datetime.datetime(2014, 1, 8, 14, 0))])
 
+    def test_recurrence_checkpoints(self):
+        self.assertEqual(self.schedule.recurrence_checkpoints, '')
+
+        programme = Programme.objects.create(name="Programme 14:00 - 15:00", current_season=1, runtime=60)
+        schedule = Schedule.objects.create(
+            programme=programme,
+            calendar=self.calendar,
+            start_dt=utc.localize(datetime.datetime(2014, 1, 2, 14, 0, 0)),
+            recurrences=recurrence.Recurrence(
+                rrules=[recurrence.Rule(recurrence.DAILY, interval=2)],
+                exrules=[recurrence.Rule(
+                    recurrence.WEEKLY, byday=[recurrence.MO, recurrence.TU])]))
+
+        self.assertTrue(schedule.recurrence_checkpoints)
+        self.assertItemsEqual(
+            schedule.dates_between(
+                utc.localize(datetime.datetime(2015, 6, 1)), utc.localize(datetime.datetime(2015, 6, 9))),
+            [utc.localize(datetime.datetime(2015, 6, 4, 14, 0)),
+             utc.localize(datetime.datetime(2015, 6, 6, 14, 0))])
+
     def test_unicode(self):
         self.assertEqual(unicode(self.schedule), 'Monday - 14:00:00')
 
+    def test_update_effective_dates(self):
+        schedule = Schedule.objects.get(id=self.schedule.id)
+        Schedule.objects.filter(id=schedule.id).update(effective_start_dt=None)
+        schedules = list(Schedule.objects.all())
+        with mock.patch.object(Programme, 'rearrange_episodes') as rearrange_episodes:
+            self.assertListEqual(update_effective_dates(schedules), [Schedule.objects.get(id=schedule.id)])
+        rearrange_episodes.assert_called_once_with(mock.ANY, self.calendar)
+        self.assertEqual(Schedule.objects.get(id=schedule.id).effective_start_dt, schedule.effective_start_dt)
+
+        with self.assertNumQueries(0):
+            self.assertListEqual(update_effective_dates(schedules), [])
+
+    def test_update_effective_dates_checkpoints(self):
+        schedule = Schedule.objects.create(
+            programme=self.programme, calendar=self.calendar, type='L',
+            start_dt=utc.localize(datetime.datetime(2014, 1, 2, 14, 0, 0)),
+            recurrences=recurrence.Recurrence(
+                rrules=[recurrence.Rule(recurrence.DAILY, interval=2)],
+                exrules=[recurrence.Rule(recurrence.WEEKLY, byday=[recurrence.MO, recurrence.TU])]))
+        checkpoints = schedule.recurrence_checkpoints
+        Schedule.objects.filter(id=schedule.id).update(recurrence_checkpoints='')
+
+        with mock.patch.object(Programme, 'rearrange_episodes'):
+            self.assertListEqual(update_effective_dates([Schedule.objects.get(id=schedule.id)]), [schedule])
+        self.assertEqual(Schedule.objects.get(id=schedule.id).recurrence_checkpoints, checkpoints)
+
+    def test_update_effective_dates_command(self):
+        Schedule.objects.update(effective_start_dt=None)
+        call_command('update_effective_dates', chunk_size=2, stdout=StringIO())
+        for schedule in Schedule.objects.all():
+            self.assertIsNotNone(schedule.effective_start_dt)
+
     @mock.patch('django.utils.timezone.now', mock_now)
     def test_save_rearrange_episodes(self):
         self.assertEqual(self.episode.issue_date, utc.localize(datetime.datetime(2014, 1, 6, 14, 0, 0)))
@@ -274,12 +331,101 @@ class CalendarModelTests(TestDataMixin, TestCase):
     def test_str(self):
         self.assertEqual(str(self.calendar), "Example")
 
+    def test_activation(self):
+        self.another_calendar.is_active = True
+        self.another_calendar.save()
+        self.assertEqual(run_pending_activations(processes=1), 1)
+
+        activation = CalendarActivation.objects.filter(calendar=self.another_calendar).latest()
+        self.assertTrue(activation.is_finished)
+        self.assertEqual(activation.total, Programme.objects.count())
+        self.assertEqual(activation.done, activation.total)
+        self.assertEqual(unicode(activation), 'Activation finished')
+        # The other calendar doesn't have schedules
+        self.assertFalse(Episode.objects.filter(issue_date__gte=timezone.now()).exists())
+
+    def test_activation_progress(self):
+        activation = CalendarActivation.objects.create(calendar=self.another_calendar, total=3, done=2)
+        run_activation(activation, processes=1)
+        activation.refresh_from_db()
+        self.assertEqual(activation.total, Programme.objects.count())
+        self.assertEqual(activation.done, activation.total)
+        self.assertTrue(activation.is_finished)
+
+    def test_queued_activation(self):
+        self.another_calendar.is_active = True
+        self.another_calendar.save()
+        activation = CalendarActivation.objects.filter(calendar=self.another_calendar).latest()
+        self.assertFalse(activation.is_finished)
+        self.assertEqual(activation.done, 0)
+
+        out = StringIO()
+        call_command('run_calendar_activations', processes=1, stdout=out)
+        self.assertEqual(out.getvalue().strip(), '1 calendar activations run')
+        activation.refresh_from_db()
+        self.assertTrue(activation.is_finished)
+        self.assertEqual(activation.done, activation.total)
+
+    def test_superseded_activations(self):
+        superseded = [
+            CalendarActivation.objects.create(calendar=self.another_calendar),
+            CalendarActivation.objects.create(calendar=self.calendar),
+        ]
+        activation = CalendarActivation.objects.create(calendar=self.calendar)
+        with mock.patch('radioco.apps.schedules.activation.run_activation') as run:
+            self.assertEqual(run_pending_activations(processes=1), 1)
+        run.assert_called_once_with(activation, 1, multiprocessing.Pool)
+        self.assertFalse(CalendarActivation.objects.filter(id__in=[_activation.id for _activation in superseded],
+                                                           finished_dt__isnull=True).exists())
+
+    def test_activation_str(self):
+        activation = CalendarActivation(calendar=self.calendar, total=3, done=1)
+        self.assertEqual(unicode(activation), 'Activating: 1 of 3 programmes')
+
+
+@override_settings(TIME_ZONE='UTC')
+class CalendarActivationPoolTests(TransactionTestCase):
+    """
+    Other processes only see committed data
+    """
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db(connection.settings_dict['NAME']):
+            self.skipTest('Other processes can\'t access an in-memory database')
+        create_test_data()
+        self.calendar = Calendar.objects.get(is_active=True)
+
+    def test_pool(self):
+        programme = Programme.objects.get(name='Classic hits')
+        episode = programme.episode_set.order_by('season', 'number_in_season').first()
+        Episode.objects.filter(id=episode.id).update(issue_date=None)
+
+        activation = CalendarActivation.objects.create(calendar=self.calendar)
+        activation.started_dt = utc.localize(datetime.datetime(2015, 1, 1))
+        activation.save()
+        run_activation(activation, processes=2)
+        activation.refresh_from_db()
+        self.assertTrue(activation.is_finished)
+        self.assertEqual(activation.done, Programme.objects.count())
+        self.assertEqual(
+            Episode.objects.get(id=episode.id).issue_date, utc.localize(datetime.datetime(2015, 1, 1, 14, 0)))
+
 
 class CalendarAdminTests(TestDataMixin, TestCase):
 
     def setUp(self):
         self.app_admin = CalendarAdmin(Calendar, AdminSite())
 
+    def test_activation_status(self):
+        CalendarActivation.objects.create(calendar=self.calendar, total=3, done=3, finished_dt=timezone.now())
+        CalendarActivation.objects.create(calendar=self.calendar, total=3, done=1)
+        with self.assertNumQueries(2):
+            status = {
+                _calendar.name: self.app_admin.activation_status(_calendar)
+                for _calendar in self.app_admin.get_queryset(None)
+            }
+        self.assertEqual(status[self.calendar.name], 'Activating: 1 of 3 programmes')
+        self.assertEqual(status[self.another_calendar.name], '')
+
     def test_clone_calendar(self):
         schedule_ids = [_schedule.id for _schedule in self.calendar.schedule_set.all()]
         num_of_schedules = len(schedule_ids)
@@ -377,6 +523,48 @@ class TransmissionModelTests(TestDataMixin, TestCase):
              (u'local-gossips', utc.localize(datetime.datetime(2015, 1, 6, 12, 0))),
              (u'classic-hits', utc.localize(datetime.datetime(2015, 1, 6, 14, 0)))])
 
+    def test_between_episodes(self):
+        other_programme = Programme.objects.get(slug='the-best-wine')
+        Episode.objects.create(
+            title='Same date', programme=other_programme, summary='', season=1, number_in_season=100,
+            issue_date=utc.localize(datetime.datetime(2015, 1, 6, 14, 0, 0)))
+        between = list(Transmission.between(
+            utc.localize(datetime.datetime(2015, 1, 6, 11, 0, 0)),
+            utc.localize(datetime.datetime(2015, 1, 6, 17, 0, 0))))
+        for transmission in between:
+            if transmission.episode:
+                self.assertEqual(transmission.episode.programme_id, transmission.programme.id)
+                self.assertEqual(transmission.episode.issue_date, transmission.start)
+        self.assertEqual(between[-1].episode, self.episode_in_transmission)
+
+        now = list(Transmission.at(utc.localize(datetime.datetime(2015, 1, 6, 14, 30, 0))))
+        self.assertListEqual(map(lambda t: t.episode, now), [self.episode_in_transmission])
+
+    def test_create_missing_episodes(self):
+        transmissions = list(Transmission.between(
+            utc.localize(datetime.datetime(2015, 2, 3, 0, 0, 0)),
+            utc.localize(datetime.datetime(2015, 2, 6, 0, 0, 0)),
+            schedules=Schedule.objects.filter(id=self.schedule.id)))
+        # Created meanwhile by another process
+        created_meanwhile = Episode.objects.create_episode(date=transmissions[0].start, programme=self.programme)
+
+        self.assertEqual(Transmission.create_missing_episodes(transmissions), 2)
+        self.assertEqual(transmissions[0].episode, created_meanwhile)
+        self.assertListEqual(
+            [(_transmission.episode.issue_date, _transmission.episode.programme) for _transmission in transmissions],
+            [(_transmission.start, self.programme) for _transmission in transmissions])
+        self.assertEqual(Transmission.create_missing_episodes(transmissions), 0)
+
+    def test_episodes_by_issue_date(self):
+        dt = utc.localize(datetime.datetime(2015, 1, 6, 14, 0, 0))
+        other_dt = utc.localize(datetime.datetime(2015, 1, 7, 14, 0, 0))
+        with self.assertNumQueries(1):
+            episodes = Episode.objects.by_issue_date([
+                (self.programme.id, dt), (self.programme.id, other_dt), (self.programme.id + 1000, dt)
+            ])
+        self.assertDictEqual(episodes, {(self.programme.id, dt): self.episode_in_transmission})
+        self.assertDictEqual(Episode.objects.by_issue_date([]), {})
+
     def test_between_by_queryset(self):
         between = Transmission.between(
             utc.localize(datetime.datetime(2015, 1, 6, 12, 0, 0)),
@@ -431,6 +619,21 @@ class ScheduleUtilsTests(TestDataMixin, TestCase):
         self.assertEqual(dates.next(), utc.localize(datetime.datetime(2015, 1, 6, 14, 0)))
         self.assertEqual(dates.next(), utc.localize(datetime.datetime(2015, 1, 6, 16, 0)))
 
+    def test_available_dates_limit(self):
+        Schedule.objects.create(
+            programme=self.programme,
+            calendar=self.calendar,
+            type="L",
+            start_dt=utc.localize(datetime.datetime(2015, 1, 6, 14, 0, 0)),
+            recurrences=recurrence.Recurrence(
+                rrules=[recurrence.Rule(recurrence.WEEKLY)]))
+
+        dates = next_dates(self.calendar, self.programme, utc.localize(datetime.datetime(2015, 1, 5)), limit=3)
+        self.assertListEqual(list(dates), [
+            utc.localize(datetime.datetime(2015, 1, 5, 14, 0)),
+            utc.localize(datetime.datetime(2015, 1, 6, 14, 0)),
+            utc.localize(datetime.datetime(2015, 1, 7, 14, 0))])
+
     def test_available_dates_none(self):
         dates = next_dates(self.calendar, Programme(), timezone.now())
         with self.assertRaises(StopIteration):
@@ -449,6 +652,125 @@ class ScheduleUtilsTests(TestDataMixin, TestCase):
             ]
         )
 
+    def test_rearrange_episodes_only_updates_moved_episodes(self):
+        after = pytz.utc.localize(datetime.datetime(2015, 1, 1))
+        calendar = Calendar.get_active()
+        self.programme.rearrange_episodes(after, calendar)
+        with self.assertNumQueries(2):
+            self.assertEqual(self.programme.rearrange_episodes(after, calendar), 0)
+
+        episodes = self.programme.episode_set.order_by('issue_date')
+        Episode.objects.filter(id=episodes[0].id).update(issue_date=None)
+        self.assertEqual(self.programme.rearrange_episodes(after, calendar), 1)
+        self.assertEqual(
+            episodes.first().issue_date, utc.localize(datetime.datetime(2015, 1, 1, 14, 0)))
+
+    @mock.patch('django.utils.timezone.now', partial(mock_now, dt=utc.localize(datetime.datetime(2015, 1, 1))))
+    def test_rearrange_episodes_after_excluded_date(self):
+        schedule = Schedule.objects.get(programme=self.programme)
+        schedule.exclude_date(utc.localize(datetime.datetime(2015, 1, 10, 14, 0)))
+        with mock.patch.object(Programme, 'rearrange_episodes') as rearrange_episodes:
+            schedule.save()
+        rearrange_episodes.assert_called_once_with(utc.localize(datetime.datetime(2015, 1, 9, 14, 0)), self.calendar)
+
+        schedule.save()
+        issue_dates = map(lambda e: e.issue_date, self.programme.episode_set.all().order_by('issue_date')[:10])
+        self.assertIn(utc.localize(datetime.datetime(2015, 1, 9, 14, 0)), issue_dates)
+        self.assertNotIn(utc.localize(datetime.datetime(2015, 1, 10, 14, 0)), issue_dates)
+        self.assertIn(utc.localize(datetime.datetime(2015, 1, 11, 14, 0)), issue_dates)
+
+    def test_update_excluded_dates(self):
+        schedule = Schedule.objects.get(programme=self.programme)
+        schedule.exclude_date(utc.localize(datetime.datetime(2015, 1, 10, 14, 0)))
+        schedule.exclude_date(utc.localize(datetime.datetime(2015, 1, 12, 14, 0)))
+        schedule.save()
+
+        with mock.patch.object(ExcludedDates, 'save') as save:
+            schedule.start_dt = utc.localize(datetime.datetime(2015, 1, 1, 16, 0))
+            schedule.save()
+        self.assertFalse(save.called)
+        excluded_dates = ExcludedDates.objects.filter(schedule=schedule).order_by('datetime')
+        self.assertListEqual(
+            list(excluded_dates.values_list('datetime', flat=True)),
+            [utc.localize(datetime.datetime(2015, 1, 10, 16, 0)), utc.localize(datetime.datetime(2015, 1, 12, 16, 0))])
+        self.assertListEqual(
+            list(schedule.dates_between(
+                utc.localize(datetime.datetime(2015, 1, 9)), utc.localize(datetime.datetime(2015, 1, 13, 23, 0)))),
+            [
+                utc.localize(datetime.datetime(2015, 1, 9, 16, 0)),
+                utc.localize(datetime.datetime(2015, 1, 11, 16, 0)),
+                utc.localize(datetime.datetime(2015, 1, 13, 16, 0)),
+            ])
+
+    def test_update_excluded_dates_start_time_unchanged(self):
+        schedule = Schedule.objects.get(programme=self.programme)
+        schedule.exclude_date(utc.localize(datetime.datetime(2015, 1, 10, 14, 0)))
+        schedule.save()
+        exdates = list(schedule.recurrences.exdates)
+
+        schedule = Schedule.objects.get(id=schedule.id)
+        schedule.start_dt = utc.localize(datetime.datetime(2014, 12, 20, 14, 0))
+        with mock.patch.object(ExcludedDates.objects, 'filter') as excluded_filter:
+            schedule._update_excluded_dates()
+        self.assertFalse(excluded_filter.called)
+        self.assertListEqual(schedule.recurrences.exdates, exdates)
+
+    @override_settings(TIME_ZONE='Europe/Madrid')
+    def test_update_excluded_dates_across_dst(self):
+        madrid_tz = pytz.timezone('Europe/Madrid')
+        schedule = Schedule.objects.create(
+            programme=self.programme, type='L', calendar=self.calendar,
+            recurrences=recurrence.Recurrence(rrules=[recurrence.Rule(recurrence.DAILY)]),
+            start_dt=madrid_tz.localize(datetime.datetime(2017, 1, 2, 14, 0)))
+        schedule.exclude_date(madrid_tz.localize(datetime.datetime(2017, 8, 10, 14, 0)))
+        schedule.save()
+
+        # Same local time, different UTC offset
+        schedule = Schedule.objects.get(id=schedule.id)
+        schedule.start_dt = madrid_tz.localize(datetime.datetime(2017, 7, 1, 14, 0))
+        schedule.save()
+        self.assertListEqual(
+            [_dt.astimezone(utc) for _dt in schedule.recurrences.exdates],
+            [utc.localize(datetime.datetime(2017, 8, 10, 12, 0))])
+        self.assertListEqual(
+            list(schedule.dates_between(
+                madrid_tz.localize(datetime.datetime(2017, 8, 9)), madrid_tz.localize(datetime.datetime(2017, 8, 12)))),
+            [
+                madrid_tz.localize(datetime.datetime(2017, 8, 9, 14, 0)),
+                madrid_tz.localize(datetime.datetime(2017, 8, 11, 14, 0)),
+            ])
+
+    @mock.patch('django.utils.timezone.now', partial(mock_now, dt=utc.localize(datetime.datetime(2015, 1, 1))))
+    def test_coalesce_rearrangements(self):
+        schedule = Schedule.objects.get(programme=self.programme)
+        with mock.patch.object(Programme, 'rearrange_episodes') as rearrange_episodes:
+            with coalesce_rearrangements():
+                schedule.exclude_date(utc.localize(datetime.datetime(2015, 1, 10, 14, 0)))
+                schedule.save()
+                schedule.exclude_date(utc.localize(datetime.datetime(2015, 1, 5, 14, 0)))
+                schedule.save()
+                self.assertFalse(rearrange_episodes.called)
+        rearrange_episodes.assert_called_once_with(utc.localize(datetime.datetime(2015, 1, 4, 14, 0)), self.calendar)
+
+    def test_coalesce_rearrangements_error(self):
+        schedule = Schedule.objects.get(programme=self.programme)
+        with mock.patch.object(Programme, 'rearrange_episodes') as rearrange_episodes:
+            with self.assertRaises(ValueError):
+                with coalesce_rearrangements():
+                    schedule.exclude_date(utc.localize(datetime.datetime(2015, 1, 10, 14, 0)))
+                    schedule.save()
+                    raise ValueError
+        self.assertFalse(rearrange_episodes.called)
+        self.assertFalse(Schedule.objects.get(id=schedule.id).recurrences.exdates)
+
+    def test_rearrange_episodes_other_calendar(self):
+        schedule = Schedule.objects.get(programme=self.programme)
+        schedule.calendar = self.another_calendar
+        schedule.save()
+        with mock.patch.object(Programme, 'rearrange_episodes') as rearrange_episodes:
+            schedule.save()
+        self.assertFalse(rearrange_episodes.called)
+
     @mock.patch('django.utils.timezone.now', partial(mock_now, dt=utc.localize(datetime.datetime(2015, 1, 1))))
     def test_rearrange_episodes_new_schedule(self):
         # Next calendar shouldn't appear due to doesn't belong to the active calendar
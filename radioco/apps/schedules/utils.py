@@ -1,9 +1,20 @@
 import datetime
+import heapq
+import threading
+from functools import wraps
 
+from django.db import transaction
 
-def next_dates(calendar, programme, after):
+from radioco.apps.radioco.utils import get_cache_version, bump_cache_version
+
+SCHEDULES_VERSION_KEY = 'schedules_version'
+
+
+def next_dates(calendar, programme, after, limit=None):
     """
     Returns: A generator with the next dates of a given programme
+
+    Keeps the next date of every schedule in a heap, only the schedules which produced the last date are advanced.
     """
     if not calendar or not calendar.id:
         return
@@ -12,15 +23,84 @@ def next_dates(calendar, programme, after):
     # Only taking into account schedules which belong to the active calendar
     schedules = Schedule.objects.filter(programme=programme, type='L', calendar=calendar)
 
-    while True:
-        candidates = map(lambda s: s.date_after(after), schedules)
-        try:
-            next_date = min(filter(lambda _dt: _dt is not None, candidates))
-        except ValueError:
-            break
+    heap = []
+    for index, schedule in enumerate(schedules):
+        date = schedule.date_after(after)
+        if date is not None:
+            heap.append((date, index, schedule))
+    heapq.heapify(heap)
 
+    yielded = 0
+    while heap and (limit is None or yielded < limit):
+        next_date = heap[0][0]
         yield next_date
+        yielded += 1
+
+        # Advancing every schedule which has the same date
         after = next_date + datetime.timedelta(seconds=1)
-        # schedules = filter(lambda t: t[1] is not None, zip(schedules, candidates))
-        schedules = [_tuple[0] for _tuple in zip(schedules, candidates) if _tuple[1] is not None]
+        while heap and heap[0][0] < after:
+            _, index, schedule = heap[0]
+            date = schedule.date_after(after)
+            if date is None:
+                heapq.heappop(heap)
+            else:
+                heapq.heapreplace(heap, (date, index, schedule))
+
+
+_rearrangements = threading.local()
+
+
+def rearrange_episodes(programme, after, calendar):
+    """
+    Rearrange the episodes of a programme, the rearrangement is postponed if it happens inside `coalesce_rearrangements`
+    """
+    pending = getattr(_rearrangements, 'pending', None)
+    if pending is None:
+        return programme.rearrange_episodes(after, calendar)
+    if programme.id in pending:
+        after = min(after, pending[programme.id][1])
+    pending[programme.id] = (programme, after, calendar)
+
+
+class coalesce_rearrangements(object):
+    """
+    Context manager (or decorator) which runs the code inside a transaction and rearranges the episodes of every
+    programme only once after the commit, starting from the earliest date requested
+    """
+
+    def __enter__(self):
+        self.is_outermost = getattr(_rearrangements, 'pending', None) is None
+        if self.is_outermost:
+            _rearrangements.pending = {}
+        self.atomic = transaction.atomic()
+        self.atomic.__enter__()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.atomic.__exit__(exc_type, exc_value, traceback)
+        finally:
+            if self.is_outermost:
+                pending = _rearrangements.pending
+                _rearrangements.pending = None
+        if self.is_outermost and exc_type is None:
+            for programme, after, calendar in pending.values():
+                programme.rearrange_episodes(after, calendar)
+
+    def __call__(self, func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            with coalesce_rearrangements():
+                return func(*args, **kwargs)
+        return inner
+
+
+def get_schedules_version():
+    """
+    Returns the shared counter which changes every time that calendars, schedules, programmes, episodes or podcasts
+    are modified
+    """
+    return get_cache_version(SCHEDULES_VERSION_KEY)
+
 
+def bump_schedules_version():
+    bump_cache_version(SCHEDULES_VERSION_KEY)
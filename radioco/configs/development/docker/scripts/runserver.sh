@@ -1,2 +1,3 @@
 #!/bin/bash -x
+${MANAGE_PY} run_calendar_activations --every 1 &
 ${MANAGE_PY} runserver 0.0.0.0:8000
@@ -46,6 +46,9 @@ CACHES = {
 
 SESSION_ENGINE = 'django.contrib.sessions.backends.cache'
 
+# Memcached is shared between processes, transmissions on air can be kept in memory
+TRANSMISSION_INDEX_HOURS = 24
+
 
 # Import local settings
 try: